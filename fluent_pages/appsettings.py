@@ -36,6 +36,12 @@ FLUENT_PAGES_LANGUAGES = getattr(settings, 'FLUENT_PAGES_LANGUAGES', parler_apps
 
 # Performance settings
 FLUENT_PAGES_PREFETCH_TRANSLATIONS = getattr(settings, 'FLUENT_PAGES_PREFETCH_TRANSLATIONS', False)
+FLUENT_PAGES_ROUTING_TABLE = getattr(settings, 'FLUENT_PAGES_ROUTING_TABLE', False)
+FLUENT_PAGES_SINGLE_QUERY_DISPATCH = getattr(settings, 'FLUENT_PAGES_SINGLE_QUERY_DISPATCH', False)
+FLUENT_PAGES_NOT_FOUND_CACHE_SIZE = getattr(settings, 'FLUENT_PAGES_NOT_FOUND_CACHE_SIZE', 0)
+FLUENT_PAGES_NOT_FOUND_CACHE_TIMEOUT = getattr(settings, 'FLUENT_PAGES_NOT_FOUND_CACHE_TIMEOUT', 60)
+FLUENT_PAGES_MENU_CACHE_TIMEOUT = getattr(settings, 'FLUENT_PAGES_MENU_CACHE_TIMEOUT', 0)
+FLUENT_PAGES_MENU_RENDERER = getattr(settings, 'FLUENT_PAGES_MENU_RENDERER', None)
 
 # Advanced settings
 FLUENT_PAGES_FILTER_SITE_ID = getattr(settings, 'FLUENT_PAGES_FILTER_SITE_ID', True)
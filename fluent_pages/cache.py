@@ -0,0 +1,140 @@
+"""
+The shared namespace of all cache keys in this package.
+
+Each site has a version number in the Django cache, which is part of every cache key.
+When a page of the site changes, :func:`expire_site_caches` increments that number,
+so all previous entries become unreachable at once, and are purged by the cache backend eventually.
+This also covers the in-process caches, such as the :class:`~fluent_pages.routing.RoutingTable`,
+which compare the version before they are used.
+
+Since no keys have to be enumerated, bulk operations only have to increment the version once:
+
+.. code-block:: python
+
+    from fluent_pages.cache import expire_site_caches
+
+    Page.objects.filter(...).update(in_navigation=False)
+    expire_site_caches()
+
+When a page is saved without changing its URL, publication or navigation fields,
+only the content version is incremented by :func:`expire_content_caches`.
+This expires the rendered responses, but keeps the routing table and menu.
+"""
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.timezone import now
+from fluent_pages import appsettings
+from future.builtins import str
+
+__all__ = (
+    'get_cache_key',
+    'get_cache_version',
+    'get_content_version',
+    'get_site_modification_date',
+    'expire_site_caches',
+    'expire_content_caches',
+)
+
+
+def _get_site_id(site_id=None):
+    # Without site filtering, all nodes are part of a single tree.
+    if not appsettings.FLUENT_PAGES_FILTER_SITE_ID:
+        return None
+    return site_id if site_id is not None else settings.SITE_ID
+
+
+def _get_version_key(site_id):
+    return 'fluent_pages.version.{0}'.format(site_id)
+
+
+def _get_content_key(site_id):
+    return 'fluent_pages.content.{0}'.format(site_id)
+
+
+def _get_modified_key(site_id):
+    return 'fluent_pages.modified.{0}'.format(site_id)
+
+
+def _new_version():
+    # When the counter is evicted from the cache, start with a value that no process has seen before.
+    return int(time() * 1000000)
+
+
+def get_cache_version(site_id=None):
+    """
+    Return the current version number of the cached data of a site.
+    """
+    return _get_version(_get_version_key(_get_site_id(site_id)))
+
+
+def get_content_version(site_id=None):
+    """
+    Return the current version number of the page contents of a site.
+    """
+    return _get_version(_get_content_key(_get_site_id(site_id)))
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_site_modification_date(site_id=None):
+    """
+    Return the moment at which the pages of the site last changed,
+    or ``None`` when this is unknown, e.g. because the cache was cleared.
+    """
+    return cache.get(_get_modified_key(_get_site_id(site_id)))
+
+
+def _increment_version(site_id, get_key=_get_version_key):
+    key = get_key(site_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+    cache.set(_get_modified_key(site_id), now(), None)
+
+
+def expire_site_caches(site_id=None):
+    """
+    Tell all processes that the pages of the site have changed.
+    """
+    site_id = _get_site_id(site_id)
+    _increment_version(site_id)
+
+    # Other processes could fill their caches while the transaction is still open,
+    # hence the version is increased again once the changes are visible to everyone.
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(lambda: _increment_version(site_id))
+
+
+def expire_content_caches(site_id=None):
+    """
+    Tell all processes that the content of a page changed, but the URLs and menu of the site are still valid.
+    """
+    site_id = _get_site_id(site_id)
+    _increment_version(site_id, _get_content_key)
+
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(lambda: _increment_version(site_id, _get_content_key))
+
+
+def get_cache_key(name, *parts, **kwargs):
+    """
+    Return a cache key within the namespace of the site, for example ``fluent_pages.menu.1.v123.en``.
+    The optional ``site_id`` keyword argument defaults to the current ``SITE_ID``.
+    """
+    site_id = kwargs.pop('site_id', None)
+    if site_id is None:
+        site_id = settings.SITE_ID
+
+    return u'.'.join(
+        [u'fluent_pages', name, str(site_id), u'v{0}'.format(get_cache_version(site_id))] + [str(part) for part in parts]
+    )
@@ -7,6 +7,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import RegexURLResolver
 from django.db import DatabaseError
+from django.db.models import Prefetch
 from django.template.response import TemplateResponse
 from django.utils.functional import SimpleLazyObject
 from fluent_pages import appsettings
@@ -109,6 +110,34 @@ class PageTypePlugin(with_metaclass(forms.MediaDefiningClass, object)):
     #: The sorting priority for the page type in the "Add Page" dialog of the admin.
     sort_priority = 100
 
+    #: The number of seconds to cache the rendered output of the page, this is disabled by default.
+    #: Only enable this when the page displays the same content to all anonymous visitors.
+    #: The cached output is no longer used once a page is saved or deleted.
+    cache_timeout = 0
+
+    #: The request headers which change the rendered output of the page, e.g. ``('Accept-Encoding',)``.
+    cache_vary_headers = ()
+
+    #: The ``max-age`` in seconds for the ``Cache-Control`` header of the page, this header is not sent by default.
+    #: The value is reduced when a page of the site is scheduled to be published or hidden sooner.
+    cache_max_age = None
+
+    #: Whether the page is sent with an ``ETag`` and ``Last-Modified`` header,
+    #: so a conditional request can be answered with a ``304 Not Modified`` response.
+    #: The validators change when any page of the site changes, or when the visitor logs in.
+    conditional_requests = False
+
+    #: The related fields to fetch in the same query as the page, e.g. ``('layout',)``.
+    select_related = ()
+
+    #: The related objects to prefetch together with the page.
+    #: This can also contain :class:`~django.db.models.Prefetch` objects.
+    prefetch_related = ()
+
+    #: The related names of translated fields to prefetch, e.g. ``('seo_translations',)``.
+    #: Only the translations of the active language and its fallback are fetched.
+    prefetch_translations = ()
+
     def __init__(self):
         self._type_id = None
         self._url_resolver = None
@@ -148,6 +177,26 @@ class PageTypePlugin(with_metaclass(forms.MediaDefiningClass, object)):
         """
         return self.model.objects.all()
 
+    def apply_query_hints(self, queryset, language_codes=None):
+        """
+        Apply the :attr:`select_related`, :attr:`prefetch_related` and :attr:`prefetch_translations` hints
+        to the queryset which fetches a page of this type.
+        This allows the page to be rendered with a fixed number of queries.
+        """
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+
+        lookups = list(self.prefetch_related)
+        for related_name in self.prefetch_translations:
+            translations = self.model._parler_meta[related_name].model.objects.all()
+            if language_codes:
+                translations = translations.filter(language_code__in=language_codes)
+            lookups.append(Prefetch(related_name, queryset=translations))
+
+        if lookups:
+            queryset = queryset.prefetch_related(*lookups)
+        return queryset
+
     def get_response(self, request, page, **kwargs):
         """
         Render the page, and return the Django :class:`~django.http.HttpResponse`.
@@ -167,6 +216,26 @@ class PageTypePlugin(with_metaclass(forms.MediaDefiningClass, object)):
             context=context,
         )
 
+    def can_cache_response(self, request, page, response):
+        """
+        Tell whether the response of the page can be stored in the cache.
+        This is only called when :attr:`cache_timeout` is set.
+        By default, all successful responses are cached, except streaming responses.
+        Requests of logged-in users and POST requests are never served from the cache.
+        """
+        return response.status_code == 200 and not getattr(response, 'streaming', False)
+
+    def get_content_version(self, request, page):
+        """
+        Return a value that changes when the displayed content changes, without saving the page itself.
+        For example, a page type which displays other objects could return their latest modification date.
+
+        The page is answered with a ``304 Not Modified`` response when the browser already has the same version.
+        By default, this returns ``None``, so only the :attr:`~fluent_pages.models.UrlNode.last_modified` date of the page is used.
+        When a version is returned, the ``Last-Modified`` header is omitted, as the date no longer describes the content.
+        """
+        return None
+
     def get_render_template(self, request, page, **kwargs):
         """
         Return the template to render for the specific `page` or `request`,
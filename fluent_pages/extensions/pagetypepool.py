@@ -8,7 +8,7 @@ from django.contrib.contenttypes.models import ContentType
 from fluent_pages.models import UrlNode
 from fluent_utils.load import import_apps_submodule
 from future.builtins import int, object
-from six import iteritems, itervalues
+from six import iteritems, itervalues, string_types
 
 from .pagetypebase import PageTypePlugin
 
@@ -43,6 +43,7 @@ class PageTypePool(object):
         self._file_types = None
         self._folder_types = None
         self._url_types = None
+        self._url_names = None
 
     def register(self, plugin):
         """
@@ -66,6 +67,7 @@ class PageTypePool(object):
         self._folder_types = None
         self._file_types = None
         self._url_types = None
+        self._url_names = None
 
         # Make a single static instance, similar to ModelAdmin.
         plugin_instance = plugin()
@@ -170,16 +172,33 @@ class PageTypePool(object):
 
         return self._url_types
 
-    def get_url_pattern_plugins(self):
+    def get_url_pattern_plugins(self, viewname=None):
         """
         Return the :class:`PageTypePlugin` instances that provide URL patterns.
+        When a view name is given, only the plugins which define an URL pattern with that name are returned.
         """
+        if viewname is not None and isinstance(viewname, string_types):
+            if self._url_names is None:
+                self._url_names = self._get_url_pattern_names()  # url_names is reset during plugin scan.
+            if viewname in self._url_names or '.' not in viewname:
+                return self._url_names.get(viewname, [])
+            # Otherwise, the name could be a dotted path to the view function.
+
         plugins = []
         for plugin in self.get_plugins():
             if plugin.urls is not None:
                 plugins.append(plugin)
         return plugins
 
+    def _get_url_pattern_names(self):
+        # Index all names of the URL patterns, so app_reverse() only has to try the plugins that define the name.
+        url_names = {}
+        for plugin in self.get_url_pattern_plugins():
+            for name in plugin.get_url_resolver().reverse_dict.keys():
+                if isinstance(name, string_types):
+                    url_names.setdefault(name, []).append(plugin)
+        return url_names
+
     def _import_plugins(self):
         """
         Internal function, ensure all plugin packages are imported.
@@ -15,6 +15,8 @@ class FluentContentsPagePlugin(PageTypePlugin):
     #: Defines the :class:`~django.contrib.admin.ModelAdmin` class to customize the screen.
     #: It should inherit from :class:`~fluent_pages.integration.fluent_contents.FluentContentsPageAdmin`.
     model_admin = FluentContentsPageAdmin
+    #: The SEO fields of the :class:`~fluent_pages.models.HtmlPage` are fetched with the page.
+    prefetch_translations = ('seo_translations',)
 
     def get_render_template(self, request, fluentpage, **kwargs):
         """
@@ -1,12 +1,19 @@
 from optparse import make_option
+from time import time
 
 import django
+from django.core.cache import cache
 from django.core.management import BaseCommand
 from django.core.management import CommandError
+from django.db import transaction
 from django.utils.encoding import smart_text
 from fluent_pages import appsettings
+from fluent_pages.cache import expire_site_caches
 from fluent_pages.extensions import page_type_pool
 from fluent_pages.models.db import UrlNode, UrlNode_Translation
+from fluent_pages.models.utils import batch_update
+from future.utils import iteritems, itervalues
+from parler.cache import get_translation_cache_key
 
 
 class Command(BaseCommand):
@@ -26,6 +33,10 @@ class Command(BaseCommand):
                 '-m', '--mptt-only', action='store_true', dest='mptt-only', default=False,
                 help="Only fix the MPTT fields, leave URLs unchanged."
             ),
+            parser.add_argument(
+                '-b', '--batch-size', action='store', type=int, dest='batch-size', default=500,
+                help="The number of changed URLs to write in a single query."
+            ),
     else:
         option_list = BaseCommand.option_list + (
             make_option(
@@ -36,6 +47,10 @@ class Command(BaseCommand):
                 '-m', '--mptt-only', action='store_true', dest='mptt-only', default=False,
                 help="Only fix the MPTT fields, leave URLs unchanged."
             ),
+            make_option(
+                '-b', '--batch-size', action='store', type='int', dest='batch-size', default=500,
+                help="The number of changed URLs to write in a single query."
+            ),
         )
 
     def handle(self, *args, **options):
@@ -44,9 +59,8 @@ class Command(BaseCommand):
 
         is_dry_run = options.get('dry-run', False)
         mptt_only = options.get('mptt-only', False)
-        slugs = {}
-        overrides = {}
-        parents = dict(UrlNode.objects.values_list('id', 'parent_id'))
+        batch_size = int(options.get('batch-size') or 500)
+        verbosity = int(options.get('verbosity', 1))
 
         self.stdout.write("Updated MPTT columns")
         if is_dry_run and mptt_only:
@@ -73,25 +87,41 @@ class Command(BaseCommand):
 
         # In a single query, walk through all objects in a logical order,
         # which traverses through the tree from parent to children.
+        # The rows are streamed, so the memory only holds the slugs and URLs, not the model objects.
         translations = (UrlNode_Translation.objects
-                        .select_related('master')
                         .order_by('master__parent_site__id', 'master__tree_id', 'master__lft', 'language_code')
+                        .values_list('id', 'language_code', 'slug', 'override_url', '_cached_url',
+                                     'master_id', 'master__parent_id', 'master__parent_site_id', 'master__polymorphic_ctype_id',
+                                     'master___translated_languages')
                         )
-
-        for translation in translations:
-            slugs.setdefault(translation.language_code, {})[translation.master_id] = translation.slug
-            overrides.setdefault(translation.language_code, {})[translation.master_id] = translation.override_url
-
-            page = translation.master
-            if page.parent_id:
-                if page.parent_id not in slugs[translation.language_code]:
+        total = translations.count()
+
+        self._parents = {}
+        self._slugs = {}
+        self._overrides = {}
+        self._paths = {}
+        new_urls = {}
+        languages = {}
+        stored_languages = {}
+        site_ids = set()
+        num_changed = 0
+        start = time()
+
+        for translation_id, language_code, slug, override_url, old_url, page_id, parent_id, site_id, ctype_id, stored in translations.iterator():
+            self._parents[page_id] = parent_id
+            languages.setdefault(page_id, set()).add(language_code)
+            stored_languages[page_id] = stored
+            self._slugs.setdefault(language_code, {})[page_id] = slug
+            self._overrides.setdefault(language_code, {})[page_id] = override_url
+
+            if parent_id:
+                if parent_id not in self._slugs[language_code]:
                     self.stderr.write("WARNING: Parent #{0} is not translated in '{1}', while the child #{2} is.".format(
-                        page.parent_id, translation.language_code, translation.master_id
+                        parent_id, language_code, page_id
                     ))
 
-            old_url = translation._cached_url
             try:
-                new_url = self._construct_url(translation.language_code, translation.master_id, parents, slugs, overrides)
+                new_url = self._construct_url(language_code, page_id)
             except KeyError:
                 if is_dry_run:
                     # When the mptt tree is broken, some URLs can't be correctly generated yet.
@@ -100,51 +130,123 @@ class Command(BaseCommand):
                 raise
 
             if old_url != new_url:
-                translation._cached_url = new_url
+                num_changed += 1
+                site_ids.add(site_id)
                 if not is_dry_run:
-                    translation.save()
+                    new_urls[translation_id] = (page_id, language_code, new_url)
+                    if len(new_urls) >= batch_size:
+                        self._write_urls(new_urls)
+                        new_urls = {}
+                        self._write_progress(num_changed, total, start)
 
-            if old_url != new_url:
                 self.stdout.write(smart_text(u"{0}  {1} {2}\n".format(
                     col_style.format(
-                        page.parent_site_id, page.pk, page.plugin.type_name,
-                        translation.language_code, translation._cached_url
+                        site_id, page_id, self._get_type_name(ctype_id),
+                        language_code, new_url
                     ),
                     "WILL CHANGE from" if is_dry_run else "UPDATED from",
                     old_url
                 )))
-            else:
+            elif verbosity > 1:
                 self.stdout.write(smart_text(col_style.format(
-                    page.parent_site_id, page.pk, page.plugin.type_name,
-                    translation.language_code, translation._cached_url
+                    site_id, page_id, self._get_type_name(ctype_id),
+                    language_code, new_url
                 )))
 
-    def _construct_url(self, language_code, child_id, parents, slugs, overrides):
-        active_choices = appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices(language_code)
-
-        breadcrumb = []
-        cur = child_id
-        while cur is not None:
-            breadcrumb.insert(0, cur)
-            cur = parents[cur]
+        if new_urls:
+            self._write_urls(new_urls)
 
-        url_parts = ['']
-        for id in breadcrumb:
+        if not is_dry_run:
+            # The languages that are stored in the node, used to filter the menu and sitemap.
+            self._write_languages(languages, stored_languages)
+
+        if not is_dry_run and num_changed:
+            for site_id in site_ids:
+                expire_site_caches(site_id)
+
+        duration = time() - start
+        self.stdout.write("{0} of {1} URLs {2} in {3:.1f} seconds ({4:.0f} translations/sec)".format(
+            num_changed, total, "will change" if is_dry_run else "updated",
+            duration, total / duration if duration else total
+        ))
+
+    def _write_urls(self, new_urls):
+        """
+        Write a batch of changed URLs.
+        """
+        with transaction.atomic():
+            batch_update(UrlNode_Translation.objects.all(), '_cached_url', dict(
+                (translation_id, url) for translation_id, (page_id, language_code, url) in iteritems(new_urls)
+            ))
+
+        # The translations are no longer saved one by one, so clear their cached copies.
+        cache.delete_many([
+            get_translation_cache_key(UrlNode_Translation, page_id, language_code)
+            for page_id, language_code, url in itervalues(new_urls)
+        ])
+
+    def _write_languages(self, languages, stored_languages):
+        """
+        Update the languages that are stored in the nodes, when these are no longer in sync with the translations.
+        """
+        new_languages = {}
+        for page_id, language_codes in iteritems(languages):
+            value = u',{0},'.format(u','.join(sorted(language_codes)))
+            if stored_languages[page_id] != value:
+                new_languages[page_id] = value
+
+        with transaction.atomic():
+            if new_languages:
+                batch_update(UrlNode.objects.all(), '_translated_languages', new_languages)
+            UrlNode.objects.filter(translations__isnull=True).exclude(_translated_languages='').update(_translated_languages='')
+
+    def _write_progress(self, num_changed, total, start):
+        duration = time() - start
+        self.stderr.write("... updated {0} URLs ({1:.0f} changes/sec)".format(
+            num_changed, num_changed / duration if duration else num_changed
+        ))
+
+    def _get_type_name(self, ctype_id):
+        return page_type_pool._get_plugin_by_content_type(ctype_id).type_name
+
+    def _get_parent_id(self, page_id):
+        try:
+            return self._parents[page_id]
+        except KeyError:
+            # A node without any translations, the stream didn't include it.
             try:
-                # Resets url_parts
-                override = overrides[language_code][id]
-                if override:
-                    url_parts = [override]
-                    continue
-            except KeyError:
-                pass
+                self._parents[page_id] = UrlNode.objects.values_list('parent_id', flat=True).get(pk=page_id)
+            except UrlNode.DoesNotExist:
+                raise KeyError(page_id)
+            return self._parents[page_id]
+
+    def _get_path(self, language_code, page_id):
+        # Return the URL parts of a node joined by '/'. These are calculated once per language,
+        # hence children only append their slug instead of walking all parent nodes again.
+        paths = self._paths.setdefault(language_code, {})
+        try:
+            return paths[page_id]
+        except KeyError:
+            pass
+
+        override = self._overrides.get(language_code, {}).get(page_id)
+        if override:
+            # Resets url_parts
+            path = override
+        else:
+            parent_id = self._get_parent_id(page_id)
+            path = self._get_path(language_code, parent_id) if parent_id is not None else u''
 
             # Add first one found, preferably the normal language, fallback otherwise.
-            for lang in active_choices:
+            for lang in appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices(language_code):
                 try:
-                    url_parts.append(slugs[lang][id])
+                    path = u'{0}/{1}'.format(path, self._slugs[lang][page_id])
                     break
                 except KeyError:
                     continue
 
-        return (u'/'.join(url_parts) + u'/').replace('//', '/')
+        paths[page_id] = path
+        return path
+
+    def _construct_url(self, language_code, child_id):
+        return (self._get_path(language_code, child_id) + u'/').replace('//', '/')
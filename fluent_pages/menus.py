@@ -0,0 +1,123 @@
+"""
+Rendering the menu without templates.
+
+The :class:`MenuRenderer` produces the same HTML as the default ``fluent_pages/parts/menu.html`` template,
+but avoids the template variable resolution for every menu item.
+It's enabled with the :ref:`FLUENT_PAGES_MENU_RENDERER` setting:
+
+.. code-block:: python
+
+    FLUENT_PAGES_MENU_RENDERER = 'fluent_pages.menus.MenuRenderer'
+
+The CSS classes can be changed in a subclass:
+
+.. code-block:: python
+
+    class MyMenuRenderer(MenuRenderer):
+        menu_class = 'nav navbar-nav'
+        active_class = 'active open'
+"""
+import os
+
+from django.template.loader import get_template
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+from fluent_pages import appsettings
+from fluent_utils.load import import_class
+
+__all__ = (
+    'MenuRenderer',
+    'get_menu_renderer',
+)
+
+_default_template_path = os.path.join(os.path.dirname(__file__), 'templates', 'fluent_pages', 'parts', 'menu.html')
+
+# The in-process state of the loaded renderer class, and whether the menu template is overwritten.
+_renderer_classes = {}
+_overwritten_templates = {}
+
+
+class MenuRenderer(object):
+    """
+    Render the menu items as nested ``<ul>/<li>`` elements.
+    """
+    #: The CSS class of the outer ``<ul>`` element.
+    menu_class = 'nav'
+
+    #: The CSS class of the active item, and the items that contain it.
+    active_class = 'active'
+
+    #: The CSS class of draft items, which are only visible to staff members.
+    draft_class = 'draft'
+
+    #: The CSS class of the last item of a level, if the nodes provide an ``is_last_child`` attribute.
+    last_class = 'last'
+
+    #: The HTML that is rendered when there are no menu items.
+    empty_html = u'<!-- No menu items returned -->'
+
+    def render(self, menu_items):
+        """
+        Return the HTML of the complete menu.
+        """
+        if not menu_items:
+            return mark_safe(u'\n{0}\n\n'.format(self.empty_html))
+
+        items = u''.join(self.render_item(node) for node in menu_items)
+        return mark_safe(u'\n<ul class="{0}">\n  {1}\n</ul>\n\n'.format(self.menu_class, items))
+
+    def render_item(self, node):
+        """
+        Return the HTML of a single menu item, including its children.
+        """
+        children = u''.join(self.render_item(child) for child in node.get_children())
+        if children:
+            children = u'<ul>{0}</ul>'.format(children)
+
+        return u'\n  <li class="{0}">\n    <a href="{1}">{2}</a>\n    {3}\n  </li>'.format(
+            self.get_item_class(node),
+            conditional_escape(node.url),
+            conditional_escape(node.title),
+            children,
+        )
+
+    def get_item_class(self, node):
+        """
+        Return the ``class`` attribute of a menu item.
+        """
+        css_class = u''
+        if node.is_active or node.is_child_active:
+            css_class = self.active_class
+        if node.is_draft:
+            css_class += u' ' + self.draft_class
+        if getattr(node, 'is_last_child', False):
+            css_class += u' ' + self.last_class
+        return css_class
+
+
+def get_menu_renderer(template_name):
+    """
+    Return the :class:`MenuRenderer` configured in :ref:`FLUENT_PAGES_MENU_RENDERER`,
+    or ``None`` when the menu should be rendered with the template.
+    """
+    import_path = appsettings.FLUENT_PAGES_MENU_RENDERER
+    if not import_path or _is_overwritten_template(template_name):
+        return None
+
+    try:
+        renderer_class = _renderer_classes[import_path]
+    except KeyError:
+        renderer_class = import_class(import_path, 'FLUENT_PAGES_MENU_RENDERER')
+        _renderer_classes[import_path] = renderer_class
+    return renderer_class()
+
+
+def _is_overwritten_template(template_name):
+    # A custom template, or a project that overrides the default template, is rendered as usual.
+    try:
+        return _overwritten_templates[template_name]
+    except KeyError:
+        origin = getattr(get_template(template_name), 'origin', None)
+        is_overwritten = origin is None or os.path.normcase(os.path.abspath(origin.name)) != os.path.normcase(os.path.abspath(_default_template_path))
+        _overwritten_templates[template_name] = is_overwritten
+        return is_overwritten
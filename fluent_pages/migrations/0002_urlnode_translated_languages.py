@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_translated_languages(apps, schema_editor):
+    UrlNode = apps.get_model('fluent_pages', 'UrlNode')
+    UrlNode_Translation = apps.get_model('fluent_pages', 'UrlNode_Translation')
+
+    languages = {}
+    for master_id, language_code in UrlNode_Translation.objects.values_list('master_id', 'language_code'):
+        languages.setdefault(master_id, set()).add(language_code)
+
+    for master_id, language_codes in languages.items():
+        UrlNode.objects.filter(pk=master_id).update(_translated_languages=u',{0},'.format(u','.join(sorted(language_codes))))
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fluent_pages', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlnode',
+            name='_translated_languages',
+            field=models.CharField(default='', max_length=255, editable=False, blank=True),
+        ),
+        migrations.RunPython(fill_translated_languages, reverse_code=noop),
+    ]
@@ -10,6 +10,7 @@ It defines the following classes:
   The layout of a page, which has regions and a template.
 """
 import logging
+from collections import OrderedDict
 
 import django
 from django.conf import settings
@@ -23,10 +24,12 @@ from django.template.defaultfilters import slugify
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from fluent_pages import appsettings
+from fluent_pages.cache import expire_content_caches, expire_site_caches
 from fluent_pages.models.fields import PageTreeForeignKey, TemplateFilePathField
-from fluent_pages.models.managers import UrlNodeManager
+from fluent_pages.models.managers import UrlNodeManager, _cache_translations
+from fluent_pages.models.utils import batch_update
 from future.utils import iteritems, itervalues, with_metaclass
-from parler.cache import get_object_cache_keys
+from parler.cache import get_object_cache_keys, get_translation_cache_key, is_missing
 from parler.fields import TranslatedField
 from parler.models import TranslatableModel, TranslatedFields, TranslatedFieldsModel
 from parler.utils import get_language_title
@@ -112,6 +115,8 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
 
     # Caching
     _cached_url = TranslatedField()
+    # The languages of all translations, e.g. ",en,nl,", to filter on languages without joining the translations table.
+    _translated_languages = models.CharField(max_length=255, blank=True, default='', editable=False)
 
     # Django settings
     objects = UrlNodeManager()
@@ -155,6 +160,8 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         self._original_pub_end_date = None
         self._original_status = None
         self._original_parent = None
+        self._original_key = None
+        self._original_navigation = None
 
         deferred = ()
         if django.VERSION >= (1, 8):
@@ -162,7 +169,7 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         else:
             if self._deferred:
                 # Assume all deferred
-                deferred = ('publication_date', 'publication_end_date', 'status', 'parent')
+                deferred = ('publication_date', 'publication_end_date', 'status', 'parent', 'key', 'in_navigation', 'tree_id', 'lft')
 
         if 'publication_date' not in deferred:
             self._original_pub_date = self.publication_date
@@ -172,8 +179,14 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
             self._original_status = self.status
         if 'parent' not in deferred:
             self._original_parent = self.parent_id
+        if 'key' not in deferred:
+            self._original_key = self.key
+        if not any(field in deferred for field in ('in_navigation', 'tree_id', 'lft')):
+            self._original_navigation = self._get_navigation_state()
 
+        self._urls_changed = None  # Collects the changes of save_translation() during save()
         self._cached_ancestors = None
+        self._identity_map = None  # Assigned by PageIdentityMap.add()
         self.is_current = None    # Can be defined by mark_current()
         self.is_onpath = None     # is an ancestor of the current node (part of the "menu trail").
 
@@ -234,13 +247,9 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         """
         Return all available URLs to this page.
         """
-        result = {}
-        for code, cached_url in self.translations.values_list('language_code', '_cached_url'):
-            with switch_language(self, code):
-                root = reverse('fluent-page').rstrip('/')
-                result[code] = root + cached_url
-
-        return result
+        if self.pk is None:
+            return {}
+        return UrlNode.objects.absolute_urls_for([self.pk]).get(self.pk, {})
 
     @property
     def url(self):
@@ -275,6 +284,40 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         nodes.append(self)
         return nodes
 
+    def _get_translated_ancestors(self):
+        """
+        Fetch the ancestors together with their translations in the active language and its fallbacks, using a single query.
+        Unlike :attr:`breadcrumb`, these are base :class:`UrlNode` objects, not the page type models.
+        This is used by the ``{% render_breadcrumb %}`` tag.
+        """
+        if self.is_root_node():
+            return []
+
+        language_code = self.get_current_language()
+        language_codes = appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices(language_code)
+        translations = list(UrlNode_Translation.objects.filter(
+            master__tree_id=self.tree_id,
+            master__lft__lt=self.lft,
+            master__rght__gt=self.rght,
+            language_code__in=language_codes,
+        ).select_related('master'))
+
+        ancestors = {}
+        for translation in translations:
+            ancestors.setdefault(translation.master_id, translation.master)
+        if len(ancestors) < self.level:
+            # Some ancestors are not translated in the active languages, these are read via the regular API.
+            ancestors = list(self.get_ancestors().non_polymorphic())
+        else:
+            ancestors = sorted(itervalues(ancestors), key=lambda node: node.level)
+            _cache_translations(ancestors, translations, language_codes)
+
+        for node in ancestors:
+            node.set_current_language(language_code)
+            if self._identity_map is not None:
+                self._identity_map.add(node)
+        return ancestors
+
     @property
     def is_published(self):
         """
@@ -371,6 +414,14 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         if parent_changed:
             self._mark_all_translations_dirty()
 
+        # All translations in the local cache are saved by save_translations() next.
+        self._set_translated_languages(self._get_translated_languages() | set(
+            language_code for language_code, translation in iteritems(self._translations_cache[UrlNode_Translation])
+            if not is_missing(translation)
+        ))
+
+        is_new = self._state.adding
+        self._urls_changed = False
         try:
             super(UrlNode, self).save(*args, **kwargs)  # Already saves translated model.
         except UrlNode_Translation.DoesNotExist:
@@ -381,12 +432,25 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
             if parent_changed:
                 self._unmark_all_translations_dirty()
             raise
+        finally:
+            urls_changed = self._urls_changed
+            self._urls_changed = None
+
+        # Expire once, for both the translations and the shared fields (e.g. the status, key or in_navigation flag).
+        # These also affect the cached menu and links. Otherwise, only the rendered pages are outdated.
+        if is_new or urls_changed or parent_changed or self._original_key != self.key \
+                or self._is_publication_changed() or self._is_navigation_changed():
+            self._expire_url_caches()
+        else:
+            expire_content_caches(self.parent_site_id)
 
         # Update state for next save (if object is persistent somewhere)
         self._original_parent = self.parent_id
         self._original_pub_date = self.publication_date
         self._original_pub_end_date = self.publication_end_date
         self._original_status = self.status
+        self._original_key = self.key
+        self._original_navigation = self._get_navigation_state()
 
     def _mark_all_translations_dirty(self):
         # Update the cached_url of all translations.
@@ -430,15 +494,18 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         self._make_slug_unique(translation)
         self._update_cached_url(translation)
         url_changed = translation.is_cached_url_modified
+        title_changed = translation.is_title_modified
         super(UrlNode, self).save_translation(translation, *args, **kwargs)
 
         # Detect changes
-        published_changed = self._original_pub_date != self.publication_date \
-            or self._original_pub_end_date != self.publication_end_date \
-            or self._original_status != self.status
+        published_changed = self._is_publication_changed()
 
-        if url_changed or published_changed or translation._fetched_parent_url:
-            self._expire_url_caches()
+        if url_changed or title_changed or published_changed or translation._fetched_parent_url:
+            if self._urls_changed is None:
+                # Called outside save()
+                self._expire_url_caches()
+            else:
+                self._urls_changed = True
 
             if url_changed:
                 # Performance optimisation: only traversing and updating many records when something changed in the URL.
@@ -455,6 +522,32 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         super(UrlNode, self).delete(*args, **kwargs)
         self._expire_url_caches()
 
+    def delete_translation(self, language_code, related_name=None):
+        num_deleted = super(UrlNode, self).delete_translation(language_code, related_name=related_name)
+        if related_name in (None, 'translations'):
+            # The database is updated by UrlNode_Translation.delete()
+            self._set_translated_languages(self._get_translated_languages() - set([language_code]))
+        return num_deleted
+
+    def _get_translated_languages(self):
+        return set(language_code for language_code in self._translated_languages.split(',') if language_code)
+
+    def _set_translated_languages(self, language_codes):
+        language_codes = sorted(language_codes)
+        self._translated_languages = u',{0},'.format(u','.join(language_codes)) if language_codes else u''
+
+    def _is_publication_changed(self):
+        return self._original_pub_date != self.publication_date \
+            or self._original_pub_end_date != self.publication_end_date \
+            or self._original_status != self.status
+
+    def _is_navigation_changed(self):
+        return self._original_navigation != self._get_navigation_state()
+
+    def _get_navigation_state(self):
+        # The menu visibility and ordering.
+        return (self.in_navigation, self.tree_id, self.lft)
+
     # Following of the principles for "clean code"
     # the save() method is split in the 3 methods below,
     # each "do one thing, and only one thing".
@@ -463,26 +556,16 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
         """
         Check for duplicate slugs at the same level, and make the current object unique.
         """
-        origslug = translation.slug
-        dupnr = 1
-        while True:
-            others = UrlNode.objects.filter(
-                parent=self.parent_id,
-                translations__slug=translation.slug,
-                translations__language_code=translation.language_code
-            ).non_polymorphic()
+        others = UrlNode.objects.all()
+        if appsettings.FLUENT_PAGES_FILTER_SITE_ID:
+            others = others.parent_site(self.parent_site_id)
 
-            if appsettings.FLUENT_PAGES_FILTER_SITE_ID:
-                others = others.parent_site(self.parent_site_id)
-
-            if self.pk:
-                others = others.exclude(pk=self.pk)
-
-            if not others.count():
-                break
-
-            dupnr += 1
-            translation.slug = "%s-%d" % (origslug, dupnr)
+        translation.slug = others.unique_slugs(
+            [translation.slug],
+            parent=self.parent_id,
+            language_code=translation.language_code,
+            exclude=self.pk
+        )[0]
 
     def _update_cached_url(self, translation):
         """
@@ -544,50 +627,55 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
                 }
 
         # Update all sub objects.
-        # even if can_have_children is false, ensure a consistent state for the URL structure
-        subobjects = self.get_descendants().order_by('lft', 'tree_id')
-        for subobject in subobjects:
-            if subobject.has_translation(current_language):
+        # even if can_have_children is false, ensure a consistent state for the URL structure.
+        # The data of all descendants is fetched in a single query, and written back in batches,
+        # so moving a large subtree doesn't load and save every page object one by one.
+        new_urls = {}
+        changed_languages = []
+        for node_id, parent_id, translations in self._get_decendant_url_data():
+            if current_language in translations:
                 # Subobject has the current translation. Use that
                 # If the level in between does not have that translation, will use the fallback instead.
-                subobject.set_current_language(current_language)
-                use_fallback_base = cached_page_urls[current_language].get(subobject.parent_id) is None
+                use_fallback_base = cached_page_urls[current_language].get(parent_id) is None
             else:
                 # The subobject is not yet translated in the parent's language.
                 # Mark explicitly as not available, so we can spot mptt inconsistencies later.
-                cached_page_urls[current_language][subobject.id] = None
+                cached_page_urls[current_language][node_id] = None
                 continue  # TODO: would this cause tree parts nodes to be missed on moving?
 
+            save_language = current_language
+            slug, override_url = translations[current_language][1:3]
+
             # Set URL, using cache for parent URL.
-            if subobject.override_url:
+            if override_url:
                 # Sub object has an explicit URL, the assignment reaffirms this to ensure consistency
-                subobject._cached_url = subobject.override_url
+                cached_url = override_url
             else:
                 # Construct the fallback URLs for all fallback languages (typically 1).
                 # Even though a regular URL was found, construct it, in case sub-sub objects need it.
                 fallback_base = None
                 fallback_lang = None
                 for lang in active_choices:
-                    parent_url = cached_page_urls[lang].get(subobject.parent_id)
+                    parent_url = cached_page_urls[lang].get(parent_id)
                     if parent_url is None:
                         # The parent didn't have a fallback for this language, hence the subobjects can't have it either.
                         # There is no base nor URL for the sub object in this language. (be explicit here, to detect KeyError)
-                        cached_page_urls[lang][subobject.id] = None
+                        cached_page_urls[lang][node_id] = None
                         use_fallback_base = True
                     else:
                         # There is a translation in this language, construct the fallback URL
-                        cached_page_urls[lang][subobject.id] = u'{0}{1}/'.format(parent_url, subobject.slug)
-                        if fallback_base is None and subobject.has_translation(lang):
+                        cached_page_urls[lang][node_id] = u'{0}{1}/'.format(parent_url, slug)
+                        if fallback_base is None and lang in translations:
                             fallback_base = parent_url
                             fallback_lang = lang
 
                 if use_fallback_base:
                     # Generate URLs using the fallback language in all path parts, no exception.
                     base = fallback_base
-                    subobject.set_current_language(fallback_lang)
+                    save_language = fallback_lang
                 else:
                     # Keep appending to the real translated URL
-                    base = cached_page_urls[current_language][subobject.parent_id]
+                    base = cached_page_urls[current_language][parent_id]
 
                 if base is None:
                     # The site doesn't have fallback languages.
@@ -595,34 +683,69 @@ class UrlNode(with_metaclass(URLNodeMetaClass, PolymorphicMPTTModel, Translatabl
                     raise ParentTranslationDoesNotExist(
                         "Can't generate URL for child #{0} in '{1}' to connect to parent #{2}.\n"
                         "The child languages are: {3}".format(
-                            subobject.id, current_language, subobject.parent_id,
-                            ','.join(subobject.get_available_languages()),
+                            node_id, current_language, parent_id,
+                            ','.join(translations.keys()),
                         ))
 
                     # Alternative:
                     # no base == no URL for sub object. (be explicit here)
-                    #subobject._cached_url = None
+                    #cached_url = None
                 else:
-                    subobject._cached_url = u'{0}{1}/'.format(base, subobject.slug)
+                    cached_url = u'{0}{1}/'.format(base, translations[save_language][1])
 
             if not use_fallback_base:
-                cached_page_urls[current_language][subobject.id] = subobject._cached_url
+                cached_page_urls[current_language][node_id] = cached_url
+
+            # Only write the translations which actually changed.
+            translation_id = translations[save_language][0]
+            if translations[save_language][3] != cached_url:
+                new_urls[translation_id] = cached_url
+                changed_languages.append((node_id, save_language))
+
+        if new_urls:
+            batch_update(UrlNode_Translation.objects.all(), '_cached_url', new_urls)
+
+            # The writes bypass the model, so the translation cache is cleared manually.
+            cache.delete_many([
+                get_translation_cache_key(UrlNode_Translation, node_id, language_code)
+                for node_id, language_code in changed_languages
+            ])
+
+    def _get_decendant_url_data(self):
+        """
+        Return the URL data of all decendant pages, ordered by tree position.
+        Each item is a tuple of ``(id, parent_id, translations)``,
+        where the translations are a dictionary of ``language_code: (translation_id, slug, override_url, _cached_url)``.
+        """
+        if self.is_leaf_node():
+            return []
+
+        descendants = OrderedDict()
+        rows = UrlNode_Translation.objects.filter(
+            master__tree_id=self.tree_id,
+            master__lft__gt=self.lft,
+            master__lft__lt=self.rght,
+        ).order_by('master__lft').values_list(
+            'master_id', 'master__parent_id',
+            'language_code', 'id', 'slug', 'override_url', '_cached_url'
+        )
+
+        for node_id, parent_id, language_code, translation_id, slug, override_url, cached_url in rows:
+            try:
+                translations = descendants[node_id][2]
+            except KeyError:
+                translations = {}
+                descendants[node_id] = (node_id, parent_id, translations)
+            translations[language_code] = (translation_id, slug, override_url, cached_url)
 
-            # call base class, so this function doesn't recurse
-            sub_translation = subobject.get_translation(subobject.get_current_language())  # reads from _translations_cache!
-            super(UrlNode, subobject).save_translation(sub_translation)
-            subobject._expire_url_caches()
+        return list(itervalues(descendants))
 
     def _expire_url_caches(self):
         """
         Reset all cache keys related to this model.
         """
-        cachekeys = [
-            # created by _get_pages_of_type()
-            'fluent_pages.instance_of.{0}.{1}'.format(self.__class__.__name__, self.parent_site_id),  # urlresolvers._get_pages_of_type()
-        ]
-        for cachekey in cachekeys:
-            cache.delete(cachekey)
+        # All cached data of the site is stored under a versioned key, including the routing table and menu.
+        expire_site_caches(self.parent_site_id)
 
 
 @python_2_unicode_compatible
@@ -663,12 +786,17 @@ class UrlNode_Translation(TranslatedFieldsModel):
         # Cache a copy of the loaded _cached_url value so we can reliably
         # determine whether it has been changed in the save handler:
         self._original_cached_url = self._cached_url
+        self._original_title = self.title
         self._fetched_parent_url = None  # Allow passing data in UrlNode.save()
 
     @property
     def is_cached_url_modified(self):
         return self._cached_url != self._original_cached_url
 
+    @property
+    def is_title_modified(self):
+        return self.title != self._original_title
+
     def save(self, *args, **kwargs):
         if not self.title and not self.slug:
             # If this empty object gets marked as dirty somehow, avoid corruption of the page tree.
@@ -681,8 +809,38 @@ class UrlNode_Translation(TranslatedFieldsModel):
                 self.language_code
             ))
 
+        is_new = self._state.adding
         super(UrlNode_Translation, self).save(*args, **kwargs)
         self._original_cached_url = self._cached_url
+        self._original_title = self.title
+
+        # UrlNode.save() already stored the language, e.g. page.translations.create() does not.
+        master = self._get_cached_master()
+        if is_new and (master is None or self.language_code not in master._get_translated_languages()):
+            self._update_master_languages()
+
+    def delete(self, *args, **kwargs):
+        super(UrlNode_Translation, self).delete(*args, **kwargs)
+        self._update_master_languages()
+
+        # The URL is no longer available, this also affects the routing table and menu.
+        master = self._get_cached_master()
+        if master is not None:
+            expire_site_caches(master.parent_site_id)
+        elif self.master_id is not None:
+            expire_site_caches(UrlNode.objects.filter(pk=self.master_id).values_list('parent_site_id', flat=True).first())
+
+    def _get_cached_master(self):
+        return getattr(self, self._meta.get_field('master').get_cache_name(), None)
+
+    def _update_master_languages(self):
+        # Update the languages of the node, without fetching it.
+        if self.master_id is None:
+            return
+
+        master = self._get_cached_master() or UrlNode(pk=self.master_id)
+        master._set_translated_languages(UrlNode_Translation.objects.filter(master=self.master_id).values_list('language_code', flat=True))
+        UrlNode.objects.filter(pk=self.master_id).update(_translated_languages=master._translated_languages)
 
     def get_ancestors(self, ascending=False, include_self=False):
         # For the delete page, mptt_breadcrumb filter in the django-polymorphic-tree templates.
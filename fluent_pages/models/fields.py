@@ -33,11 +33,20 @@ class TemplateFilePathField(models.FilePathField):
 class TranslatedForeignKeyDescriptor(ForwardManyToOneDescriptor):
 
     def __get__(self, instance, instance_type=None):
+        # When the page was fetched in the current request, the parent may be fetched already too.
+        identity_map = getattr(instance, '_identity_map', None)
+        if identity_map is not None and not hasattr(instance, self.field.get_cache_name()):
+            parent = identity_map.get(getattr(instance, self.field.attname))
+            if parent is not None:
+                setattr(instance, self.field.get_cache_name(), parent)
+
         # let the .parent return an object in the same language as our selves.
         # note: when the object is switched to a different language, this updates the shared/cached parent.
         obj = super(TranslatedForeignKeyDescriptor, self).__get__(instance, instance_type)
         if instance is not None and obj is not None:
             obj.set_current_language(instance.get_current_language())
+            if identity_map is not None and obj._identity_map is None:
+                identity_map.add(obj)
         return obj
 
 
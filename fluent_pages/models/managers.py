@@ -1,19 +1,135 @@
 """
 The manager class for the CMS models
 """
+import operator
+from collections import OrderedDict
+from functools import reduce
+from hashlib import md5
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, models, transaction
 from django.db.models.query_utils import Q
+from django.template.defaultfilters import slugify
+from django.utils.encoding import force_bytes
 from django.utils.timezone import now
-from django.utils.translation import get_language
+from django.utils.translation import get_language, override
 from fluent_pages import appsettings
+from fluent_pages.cache import get_cache_key
 from future.builtins import range
+from future.utils import iteritems, string_types
 from parler import is_multilingual_project
+from parler.cache import MISSING, is_missing
 from parler.managers import TranslatableManager, TranslatableQuerySet
 from polymorphic_tree.managers import PolymorphicMPTTModelManager, PolymorphicMPTTQuerySet
 
 from .utils import DecoratingQuerySet
 
 
+def split_path_levels(path):
+    """
+    Split the URL path in all parent paths, e.g. ``/photos/album/`` becomes ``['/', '/photos/', '/photos/album/']``.
+    """
+    paths = []
+    if path:
+        tokens = path.rstrip('/').split('/')
+        paths += [u'{0}/'.format(u'/'.join(tokens[:i])) for i in range(1, len(tokens) + 1)]
+
+        # If the original URL didn't end with a slash,
+        # make sure the splitted path also doesn't.
+        if path[-1] != '/':
+            paths[-1] = paths[-1].rstrip('/')
+
+    return paths
+
+
+def _set_matched_language(obj, language_codes):
+    """
+    Activate the language in which the object was found by :func:`UrlNodeQuerySet._order_by_languages`.
+    The language is also stored in ``_matched_language``, for both the preferred and fallback language.
+    """
+    language_code = language_codes[obj._language_index]
+    obj.set_current_language(language_code)  # NOTE: Explicitly set language to the state the object was fetched in.
+    obj._matched_language = language_code
+    if language_code != language_codes[0] and not obj._has_first_language:
+        # Tell django-parler the preferred translation doesn't exist, so has_translation() doesn't need a query.
+        obj._translations_cache[obj._parler_meta.root_model][language_codes[0]] = MISSING
+    return obj
+
+
+def _prime_translations(objects, language_codes):
+    """
+    Fetch the translations of the objects in the given languages, and store these in the django-parler cache.
+    """
+    if not objects:
+        return
+
+    meta = objects[0]._parler_meta.root
+    translations = meta.model.objects.filter(master__in=[obj.pk for obj in objects], language_code__in=language_codes)
+    _cache_translations(objects, translations, language_codes)
+
+
+def _cache_translations(objects, translations, language_codes):
+    """
+    Store the fetched translations in the django-parler cache of the objects,
+    the other languages are marked as missing.
+    """
+    meta = objects[0]._parler_meta.root
+    translations = dict(((translation.master_id, translation.language_code), translation) for translation in translations)
+
+    for obj in objects:
+        local_cache = obj._translations_cache[meta.model]
+        for language_code in language_codes:
+            if language_code not in local_cache:
+                translation = translations.get((obj.pk, language_code), MISSING)
+                if translation is not MISSING:
+                    translation.master = obj  # Fill the ORM cache.
+                local_cache[language_code] = translation
+
+
+def _make_unique_slugs(slugs, taken):
+    """
+    Add a ``-2``, ``-3``, etc.. suffix to the slugs which are already taken.
+    """
+    unique_slugs = []
+    for slug in slugs:
+        unique_slug = slug
+        dupnr = 1
+        while unique_slug in taken:
+            dupnr += 1
+            unique_slug = "%s-%d" % (slug, dupnr)
+
+        taken.add(unique_slug)
+        unique_slugs.append(unique_slug)
+    return unique_slugs
+
+
+def _count_nodes(nodes):
+    return sum(1 + _count_nodes(children) for page, children in nodes)
+
+
+def _assign_tree_fields(nodes, tree_id, level, lft):
+    # Assign the MPTT fields of a (page, children) tree, return the next free left value.
+    for page, children in nodes:
+        page.tree_id = tree_id
+        page.level = level
+        page.lft = lft
+        lft = _assign_tree_fields(children, tree_id, level + 1, lft + 1)
+        page.rght = lft
+        lft += 1
+    return lft
+
+
+def _iter_sibling_groups(nodes, parent):
+    # Yield the (parent, pages) of each level, parents before their children.
+    yield parent, [page for page, children in nodes]
+    for page, children in nodes:
+        if children:
+            for group in _iter_sibling_groups(children, page):
+                yield group
+
+
 class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQuerySet):
     """
     Queryset methods for UrlNode objects.
@@ -22,12 +138,65 @@ class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQ
     def __init__(self, *args, **kwargs):
         super(UrlNodeQuerySet, self).__init__(*args, **kwargs)
         self._parent_site = None
+        self._prefetch_languages = None
+        self._identity_map = None
 
     def _clone(self, *args, **kwargs):
         c = super(UrlNodeQuerySet, self)._clone(*args, **kwargs)
         c._parent_site = self._parent_site
+        c._prefetch_languages = self._prefetch_languages
+        c._identity_map = self._identity_map
         return c
 
+    def _fetch_all(self):
+        is_fetched = self._result_cache is not None
+        super(UrlNodeQuerySet, self)._fetch_all()
+        if not is_fetched and self._prefetch_languages:
+            _prime_translations([obj for obj in self._result_cache if isinstance(obj, self.model)], self._prefetch_languages)
+        if not is_fetched and self._identity_map is not None:
+            for obj in self._result_cache:
+                if isinstance(obj, self.model):
+                    self._identity_map.add(obj)
+
+    def prefetch_active_translations(self, language_code=None):
+        """
+        Prefetch only the translations of the active language and its fallback languages,
+        instead of all translations like ``prefetch_related('translations')`` does.
+        These are stored in the translations cache of django-parler,
+        which also remembers which of these languages are not translated.
+        """
+        c = self._clone()
+        c._prefetch_languages = appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices(language_code)
+        return c
+
+    def using_identity_map(self, identity_map):
+        """
+        Register the fetched pages in the :class:`~fluent_pages.models.utils.PageIdentityMap` of the request.
+        Their parents are then read from the identity map, and the translations are shared with other instances of the same page.
+        """
+        c = self._clone()
+        c._identity_map = identity_map
+        return c
+
+    def stored_translations(self, *language_codes):
+        """
+        Only return objects which are translated in one of the given languages.
+        Unlike :func:`translated`, this reads the languages stored in the node, without joining the translations table.
+        These are updated when a translation is saved or deleted;
+        run ``manage.py rebuild_page_tree`` when the translations are changed in a different way.
+        """
+        if not language_codes:
+            language_codes = (get_language(),)
+        return self.filter(reduce(operator.or_, [
+            Q(_translated_languages__contains=u',{0},'.format(language_code)) for language_code in language_codes
+        ]))
+
+    def active_stored_translations(self, language_code=None):
+        """
+        Like :func:`active_translations`, but this reads the languages stored in the node.
+        """
+        return self.stored_translations(*appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices(language_code))
+
     def active_translations(self, language_code=None, **translated_fields):
         # overwritten to honor our settings instead of the django-parler defaults
         language_codes = appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices(language_code)
@@ -38,6 +207,9 @@ class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQ
         Return the UrlNode for the given path.
         The path is expected to start with an initial slash.
 
+        The *language_code* can also be a list of languages, ordered by preference (e.g. the active language and its fallback).
+        The object is then returned in the first language that has the path, using a single query.
+
         Raises UrlNode.DoesNotExist when the item is not found.
 
         .. versionchanged:: 0.9 This filter only returns the pages of the current site.
@@ -46,6 +218,17 @@ class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQ
             language_code = self._language or get_language()
 
         # Don't normalize slashes, expect the URLs to be sane.
+        if not isinstance(language_code, string_types):
+            try:
+                obj = self._single_site() \
+                          .filter(translations___cached_url=path, translations__language_code__in=language_code) \
+                          ._order_by_languages(language_code)[0]
+                return _set_matched_language(obj, language_code)
+            except IndexError:
+                raise self.model.DoesNotExist(u"No published {0} found for the path '{1}', tried languages: {2}".format(
+                    self.model.__name__, path, ', '.join(language_code)
+                ))
+
         try:
             obj = self._single_site().get(translations___cached_url=path, translations__language_code=language_code)
             obj.set_current_language(language_code)  # NOTE. Explicitly set language to the state the object was fetched in.
@@ -59,6 +242,9 @@ class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQ
 
         UrlNode.objects.best_match_for_path('/photos/album/2008/09') might return the page with url '/photos/album/'.
 
+        Like :func:`get_for_path`, the *language_code* can also be a list of languages, ordered by preference.
+        The closest page in the first language is returned, before any page in the next languages is considered.
+
         .. versionchanged:: 0.9 This filter only returns the pages of the current site.
         """
         if language_code is None:
@@ -67,6 +253,18 @@ class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQ
         # Based on FeinCMS:
         paths = self._split_path_levels(path)
 
+        if not isinstance(language_code, string_types):
+            try:
+                qs = self._single_site() \
+                         .filter(translations___cached_url__in=paths, translations__language_code__in=language_code) \
+                         .extra(select={'_url_length': 'LENGTH(_cached_url)'}) \
+                         ._order_by_languages(language_code, '-level', '-_url_length')
+                return _set_matched_language(qs[0], language_code)
+            except IndexError:
+                raise self.model.DoesNotExist(u"No published {0} found for the path '{1}', tried languages: {2}".format(
+                    self.model.__name__, path, ', '.join(language_code)
+                ))
+
         try:
             qs = self._single_site() \
                      .filter(translations___cached_url__in=paths, translations__language_code=language_code) \
@@ -78,22 +276,74 @@ class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQ
         except IndexError:
             raise self.model.DoesNotExist(u"No published {0} found for the path '{1}'".format(self.model.__name__, path))
 
+    def absolute_urls_for(self, ids, language_codes=None):
+        """
+        Return the URLs of the given page IDs in a dictionary of ``{id: {language_code: url}}``.
+        All URLs are read in a single query, and cached until a page of the site changes.
+        By default, all languages are returned.
+        """
+        from fluent_pages.models import UrlNode_Translation  # the import can't be globally, that gives a circular dependency
+        ids = sorted(set(ids))
+        if not ids:
+            return {}
+
+        key = u'{0};{1}'.format(u','.join(str(id) for id in ids), u','.join(language_codes or ()))
+        cachekey = get_cache_key('absolute_urls', md5(force_bytes(key)).hexdigest())
+        cached_urls = cache.get(cachekey)
+        if cached_urls is None:
+            translations = UrlNode_Translation.objects.filter(master__in=ids)
+            if language_codes:
+                translations = translations.filter(language_code__in=language_codes)
+
+            cached_urls = {}
+            for master_id, language_code, cached_url in translations.values_list('master_id', 'language_code', '_cached_url'):
+                cached_urls.setdefault(master_id, {})[language_code] = cached_url
+            cache.set(cachekey, cached_urls)
+
+        # The root is not cached, as it depends on the current script prefix.
+        roots = {}
+        result = {}
+        for master_id, urls in iteritems(cached_urls):
+            result[master_id] = {}
+            for language_code, cached_url in iteritems(urls):
+                if language_code not in roots:
+                    with override(language_code):
+                        roots[language_code] = reverse('fluent-page').rstrip('/')
+                result[master_id][language_code] = roots[language_code] + cached_url
+        return result
+
+    def _order_by_languages(self, language_codes, *ordering):
+        """
+        Order the results by the preferred language.
+        The translations should already be filtered on these languages, in the same ``filter()`` call as the other fields.
+        Each object receives a ``_language_index`` to tell which language matched,
+        and a ``_has_first_language`` flag to tell whether the preferred translation exists at all.
+        """
+        from fluent_pages.models import UrlNode_Translation  # the import can't be globally, that gives a circular dependency
+        qn = connection.ops.quote_name
+        translations_table = qn(UrlNode_Translation._meta.db_table)
+        language_column = qn(UrlNode_Translation._meta.get_field('language_code').column)
+        master_column = qn(UrlNode_Translation._meta.get_field('master').column)
+
+        # Using the join of the translations filter, like the '_url_length' in best_match_for_path() does.
+        select = OrderedDict([
+            ('_language_index', 'CASE {0}.{1} {2} END'.format(
+                translations_table, language_column, ' '.join('WHEN %s THEN {0}'.format(i) for i in range(len(language_codes)))
+            )),
+            ('_has_first_language', 'EXISTS(SELECT 1 FROM {0} first_language WHERE first_language.{1} = {2}.{3} AND first_language.{4} = %s)'.format(
+                translations_table, master_column, qn(self.model._meta.db_table), qn(self.model._meta.pk.column), language_column
+            )),
+        ])
+
+        return self.extra(select=select, select_params=list(language_codes) + [language_codes[0]]) \
+            .order_by('_language_index', *ordering)
+
     def _split_path_levels(self, path):
         """
         Split the URL path, used by best_match_for_path()
         """
         # This is a separate function to allow unit testing.
-        paths = []
-        if path:
-            tokens = path.rstrip('/').split('/')
-            paths += [u'{0}/'.format(u'/'.join(tokens[:i])) for i in range(1, len(tokens) + 1)]
-
-            # If the original URL didn't end with a slash,
-            # make sure the splitted path also doesn't.
-            if path[-1] != '/':
-                paths[-1] = paths[-1].rstrip('/')
-
-        return paths
+        return split_path_levels(path)
 
     def get_for_key(self, key):
         """
@@ -110,6 +360,30 @@ class UrlNodeQuerySet(TranslatableQuerySet, DecoratingQuerySet, PolymorphicMPTTQ
             else:
                 raise self.model.DoesNotExist("{0} with key='{1}' does not exist.".format(self.model.__name__, key))
 
+    def unique_slugs(self, slugs, parent=None, language_code=None, exclude=None):
+        """
+        Return unique versions of the given slugs, for new pages below the same parent.
+
+        Slugs that are already taken (or requested twice) receive a ``-2``, ``-3``, etc.. suffix,
+        similar to what saving a page does. The sibling slugs are fetched in a single query,
+        so this can reserve the slugs of many new pages at once, e.g. during an import.
+        """
+        slugs = list(slugs)
+        if not slugs:
+            return []
+        if language_code is None:
+            language_code = get_language()
+
+        # Fetch all sibling slugs which could collide; both 'slug' and 'slug-N'.
+        slug_filter = reduce(operator.or_, [
+            Q(translations__slug=slug) | Q(translations__slug__startswith=slug + '-') for slug in set(slugs)
+        ])
+        qs = self.non_polymorphic().filter(slug_filter, parent=parent, translations__language_code=language_code)
+        if exclude is not None:
+            qs = qs.exclude(pk=exclude)
+        taken = set(qs.values_list('translations__slug', flat=True))
+        return _make_unique_slugs(slugs, taken)
+
     def parent_site(self, site):
         """
         .. versionadded:: 0.9 Filter to the given site.
@@ -230,15 +504,166 @@ class UrlNodeManager(PolymorphicMPTTModelManager, TranslatableManager):
         .. versionadded:: 0.9 Return the UrlNode for the given key.
 
         The key can be a slug-like value that was configured in ``FLUENT_PAGES_KEY_CHOICES``.
+        To only link to the page, use :func:`~fluent_pages.urlresolvers.key_reverse` instead, which is cached.
         """
         return self.all().get_for_key(key)
 
+    def unique_slugs(self, slugs, parent=None, language_code=None, exclude=None):
+        """
+        Return unique versions of the given slugs, for new pages below the same parent.
+        """
+        return self.all().unique_slugs(slugs, parent=parent, language_code=language_code, exclude=exclude)
+
     def parent_site(self, site):
         """
         .. versionadded:: 0.9 Filter to the given site.
         """
         return self.all().parent_site(site)
 
+    @transaction.atomic
+    def bulk_import(self, nodes, parent=None):
+        """
+        Insert a complete tree of new pages at once, e.g. to migrate a site from another CMS.
+
+        The *nodes* are a list of ``(page, children)`` tuples, where ``page`` is an unsaved page object
+        with all its translations assigned, and ``children`` is a list in the same format.
+        The pages are added as last children of the *parent*, or as new root nodes.
+
+        The tree structure, unique slugs and URLs are calculated in memory,
+        the translations are inserted with ``bulk_create()``, and the caches are expired once at the end.
+        Returns all created pages in tree order. Their translations are fetched again when these are accessed.
+        """
+        from fluent_pages.models import UrlNode, UrlNode_Translation
+
+        if not nodes:
+            return []
+
+        # Assign the tree positions, making room below the parent first.
+        if parent is not None:
+            tree_id, parent_rght, parent_level = UrlNode.objects.filter(pk=parent.pk).values_list('tree_id', 'rght', 'level')[0]
+            size = _count_nodes(nodes) * 2
+            UrlNode._tree_manager._create_space(size, parent_rght - 1, tree_id)
+            parent.rght = parent_rght + size
+            _assign_tree_fields(nodes, tree_id, parent_level + 1, parent_rght)
+        else:
+            tree_id = UrlNode._tree_manager._get_next_tree_id()
+            for i, node in enumerate(nodes):
+                _assign_tree_fields([node], tree_id + i, 0, 1)
+
+        # Collect all translations, and ensure unique slugs and URLs per level.
+        # Unsaved model instances are not hashable, hence the id() keys.
+        pages = []
+        parents = {}
+        translations = OrderedDict()
+        parent_urls = {}
+        if parent is not None:
+            parent_urls[id(parent)] = dict(UrlNode_Translation.objects.filter(master=parent.pk).values_list('language_code', '_cached_url'))
+
+        for level_parent, siblings in _iter_sibling_groups(nodes, parent):
+            for page in siblings:
+                pages.append(page)
+                parents[id(page)] = level_parent
+                for meta in page._parler_meta:
+                    translations.setdefault(meta.model, []).extend(
+                        (page, translation) for translation in page._translations_cache[meta.model].values() if not is_missing(translation)
+                    )
+
+            self._assign_unique_slugs(siblings, level_parent, is_new_parent=(level_parent is not parent))
+            for page in siblings:
+                parent_urls[id(page)] = self._assign_cached_urls(page, level_parent, parent_urls.get(id(level_parent)))
+
+        # Insert the nodes in tree order, so all parent IDs are known.
+        # Models with multi-table inheritance don't support bulk_create(), hence these are inserted one by one.
+        pages.sort(key=lambda page: (page.tree_id, page.lft))
+        for page in pages:
+            level_parent = parents[id(page)]
+            page.parent_id = level_parent.pk if level_parent is not None else None
+            page._set_translated_languages(
+                language_code for language_code, translation in iteritems(page._translations_cache[UrlNode_Translation])
+                if not is_missing(translation)
+            )
+            page.pre_save_polymorphic()
+            models.Model.save_base(page, force_insert=True)
+
+            # Update the state that save() normally tracks.
+            page._mptt_meta.update_mptt_cached_fields(page)
+            page._mptt_saved = True
+            page._original_parent = page.parent_id
+            page._original_key = page.key
+            page._original_navigation = page._get_navigation_state()
+
+        for translated_model, items in iteritems(translations):
+            for page, translation in items:
+                translation.master = page
+            translated_model.objects.bulk_create([translation for page, translation in items])
+
+        for page in pages:
+            page._translations_cache.clear()
+
+        pages[0]._expire_url_caches()
+        return pages
+
+    def _assign_unique_slugs(self, siblings, parent, is_new_parent):
+        # The siblings below an existing parent are compared with the database,
+        # all other slugs only need to be unique amongst themselves.
+        from fluent_pages.models import UrlNode_Translation
+        groups = {}
+        for page in siblings:
+            for translation in page._translations_cache[UrlNode_Translation].values():
+                if is_missing(translation):
+                    continue
+                if not translation.slug and translation.title:
+                    translation.slug = slugify(translation.title)
+                groups.setdefault((page.parent_site_id, translation.language_code), []).append(translation)
+
+        for (site_id, language_code), group in iteritems(groups):
+            slugs = [translation.slug for translation in group]
+            if is_new_parent:
+                slugs = _make_unique_slugs(slugs, set())
+            else:
+                qs = self.all()
+                if appsettings.FLUENT_PAGES_FILTER_SITE_ID:
+                    qs = qs.parent_site(site_id)
+                slugs = qs.unique_slugs(slugs, parent=parent, language_code=language_code)
+
+            for translation, slug in zip(group, slugs):
+                translation.slug = slug
+
+    def _assign_cached_urls(self, page, parent, parent_urls):
+        # Same logic as UrlNode._update_cached_url(), using the URLs that are already known.
+        from fluent_pages.models import UrlNode_Translation
+        from fluent_pages.models.db import ParentTranslationDoesNotExist
+        urls = {}
+        for translation in page._translations_cache[UrlNode_Translation].values():
+            if is_missing(translation):
+                continue
+
+            language_code = translation.language_code
+            if translation.override_url:
+                translation._cached_url = translation.override_url
+            else:
+                if parent is None:
+                    parent_url = '/'
+                else:
+                    try:
+                        parent_url = parent_urls[language_code]
+                    except KeyError:
+                        raise ParentTranslationDoesNotExist(
+                            "Can't determine URL for language ({0}) when parent node only has URLs in {1}.".format(
+                                language_code, ", ".join(parent_urls.keys())
+                            ))
+
+                if not parent_url[-1] == '/':
+                    parent_url += '/'
+
+                if page.is_file:
+                    translation._cached_url = u'{0}{1}'.format(parent_url, translation.slug)
+                else:
+                    translation._cached_url = u'{0}{1}/'.format(parent_url, translation.slug)
+
+            urls[language_code] = translation._cached_url
+        return urls
+
     def published(self, for_user=None):
         """
         Return only published pages for the current site.
@@ -266,6 +691,30 @@ class UrlNodeManager(PolymorphicMPTTModelManager, TranslatableManager):
         """
         return self.all().toplevel()
 
+    def prefetch_active_translations(self, language_code=None):
+        """
+        Prefetch only the translations of the active language and its fallback languages.
+        """
+        return self.all().prefetch_active_translations(language_code)
+
+    def stored_translations(self, *language_codes):
+        """
+        Only return pages which are translated in one of the given languages, without joining the translations table.
+        """
+        return self.all().stored_translations(*language_codes)
+
+    def active_stored_translations(self, language_code=None):
+        """
+        Only return pages which are translated in the active language or its fallback languages, without joining the translations table.
+        """
+        return self.all().active_stored_translations(language_code)
+
+    def absolute_urls_for(self, ids, language_codes=None):
+        """
+        Return the URLs of the given page IDs in a dictionary of ``{id: {language_code: url}}``.
+        """
+        return self.all().absolute_urls_for(ids, language_codes=language_codes)
+
     def toplevel_navigation(self, current_page=None, for_user=None, language_code=None):
         """
         Return all toplevel items, ordered by menu ordering.
@@ -275,24 +724,31 @@ class UrlNodeManager(PolymorphicMPTTModelManager, TranslatableManager):
         qs = self.toplevel().in_navigation(for_user=for_user).non_polymorphic()._mark_current(current_page)
 
         # Make sure only translated menu items are visible.
+        language_code = self._get_navigation_language(current_page, language_code)
+        qs = qs.prefetch_active_translations(language_code)
         if is_multilingual_project():
-            if language_code is None:
-                if current_page is None or getattr(current_page, '_fetched_in_fallback_language', False):
-                    # Show the menu in the current site language.
-                    # When a page is fetched in a fallback, the menu shouldn't change.
-                    language_code = get_language()
-                else:
-                    # This exists to preserve old behavior. Maybe it can be removed:
-                    language_code = current_page.get_current_language()
-
             lang_dict = appsettings.FLUENT_PAGES_LANGUAGES.get_language(language_code)
             if lang_dict['hide_untranslated_menu_items']:
-                qs = qs.translated(language_code)
+                qs = qs.stored_translations(language_code)
             else:
-                qs = qs.active_translations(language_code)
+                qs = qs.active_stored_translations(language_code)
 
         return qs
 
+    def _get_navigation_language(self, current_page=None, language_code=None):
+        """
+        Return the language that :func:`toplevel_navigation` uses for the menu.
+        """
+        if language_code is None:
+            if current_page is None or getattr(current_page, '_fetched_in_fallback_language', False):
+                # Show the menu in the current site language.
+                # When a page is fetched in a fallback, the menu shouldn't change.
+                language_code = get_language()
+            else:
+                # This exists to preserve old behavior. Maybe it can be removed:
+                language_code = current_page.get_current_language()
+        return language_code
+
     def url_pattern_types(self):
         """
         Return only page types which have a custom URLpattern attached.
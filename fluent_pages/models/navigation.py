@@ -19,6 +19,7 @@ class NavigationNode(object):
     """
     The base class for all navigation nodes, whether model-based on virtually inserted ones.
     """
+    __slots__ = ()
 
     # Off course, the subclasses could just implement
     # the same properties (signature-based polymorphism)
@@ -44,6 +45,9 @@ class NavigationNode(object):
     has_children = property(_not_implemented, doc='Whether the node has children.')
     page = None
 
+    #: The URLs of the node in each language, as filled by the ``{% get_alternate_urls %}`` tag.
+    alternate_urls = None
+
     # TODO: active trail item
 
     # --- Compatibility with mptt recursetree
@@ -81,9 +85,10 @@ class PageNavigationNode(NavigationNode):
     An implementation of the :class:`NavigationNode` for :class:`~fluent_pages.models.Page` models.
     """
 
-    def __init__(self, page, parent_node=None, max_depth=9999, current_page=None, for_user=None):
+    def __init__(self, page, parent_node=None, max_depth=9999, current_page=None, for_user=None, child_pages=None):
         """
         Initialize the node with a Page.
+        When the *child_pages* dictionary is given, the children are read from it instead of querying the database.
         """
         assert page.in_navigation, "PageNavigationNode can't take page #%d (%s) which is not visible in the navigation." % (page.id, page.url)
         super(NavigationNode, self).__init__()
@@ -93,6 +98,8 @@ class PageNavigationNode(NavigationNode):
         self._children = None
         self._max_depth = max_depth
         self._user = for_user
+        self._child_pages = child_pages
+        self._child_nodes = None
 
         # Depths starts relative to the first level.
         if not parent_node:
@@ -127,7 +134,7 @@ class PageNavigationNode(NavigationNode):
     @property
     def parent(self):
         if not self._parent_node and not self._page.is_root_node():
-            self._parent_node = PageNavigationNode(self._page.get_parent(), max_depth=self._max_depth, current_page=self._current_page)
+            self._parent_node = PageNavigationNode(self._page.parent, max_depth=self._max_depth, current_page=self._current_page)
         return self._parent_node
 
     @parent.setter
@@ -139,12 +146,20 @@ class PageNavigationNode(NavigationNode):
     def children(self):
         self._read_children()
         if self._children is not None:
-            for child in self._children:
-                if child.pk == self._page.pk:
-                    # This happened with the get_query_set() / get_queryset() transition for Django 1.7, affecting Django 1.4/1.5
-                    raise RuntimeError("Page #{0} children contained self!".format(self._page.pk))
+            # The nodes are created once, iterating the children again returns the same objects.
+            if self._child_nodes is None:
+                self._child_nodes = []
+                for child in self._children:
+                    if child.pk == self._page.pk:
+                        # This happened with the get_query_set() / get_queryset() transition for Django 1.7, affecting Django 1.4/1.5
+                        raise RuntimeError("Page #{0} children contained self!".format(self._page.pk))
+
+                    self._child_nodes.append(PageNavigationNode(
+                        child, parent_node=self, max_depth=self._max_depth, current_page=self._current_page, child_pages=self._child_pages
+                    ))
 
-                yield PageNavigationNode(child, parent_node=self, max_depth=self._max_depth, current_page=self._current_page)
+            for node in self._child_nodes:
+                yield node
 
     @property
     def has_children(self):
@@ -154,8 +169,14 @@ class PageNavigationNode(NavigationNode):
     def _read_children(self):
         if self._children is None and not self._page.is_leaf_node():
             if (self._page.get_level() + 1) < self._max_depth:  # level 0 = toplevel.
+                if self._child_pages is not None:
+                    # The complete menu was fetched at once.
+                    self._children = self._child_pages.get(self._page.pk, [])
+                    return
+
                 # children = self._page.get_children()  # Via MPTT
-                self._children = self._page.children.in_navigation(for_user=self._user)._mark_current(self._current_page)  # Via RelatedManager
+                self._children = self._page.children.in_navigation(for_user=self._user)._mark_current(self._current_page) \
+                    .prefetch_active_translations().using_identity_map(self._page._identity_map)  # Via RelatedManager
 
                 # If the parent wasn't polymorphic, neither will it's children be.
                 if self._page.get_real_instance_class() is not self._page.__class__:
@@ -175,3 +196,100 @@ class PageNavigationNode(NavigationNode):
         .. versionadded:: 0.9 Provide access to the underlying page object, if it exists.
         """
         return self._page
+
+
+class CompactNavigationNode(NavigationNode):
+    """
+    A lightweight implementation of the :class:`NavigationNode`, which only holds the data to render a menu.
+
+    Unlike the :class:`PageNavigationNode`, it doesn't keep a reference to the page object.
+    This makes it cheap to pickle a complete menu in the cache.
+    Use :func:`mark_active_nodes` to update the active state for the current page.
+    """
+    __slots__ = (
+        'pk', 'slug', 'title', 'url', 'level', 'tree_id', 'lft', 'rght', 'is_published', 'is_draft',
+        'is_active', 'is_child_active', 'parent', 'children', '_cached_children', '_page', 'alternate_urls',
+    )
+
+    def __init__(self, page, parent_node=None):
+        """
+        Initialize the node with the data of a Page.
+        """
+        super(CompactNavigationNode, self).__init__()
+        self.pk = page.pk
+        self.slug = page.slug
+        self.title = page.title
+        self.url = page.url
+        self.level = page.level
+        self.tree_id = page.tree_id
+        self.lft = page.lft
+        self.rght = page.rght
+        self.is_published = page.is_published
+        self.is_draft = page.is_draft
+        self.is_active = False
+        self.is_child_active = False
+        self.parent = parent_node
+        self.children = []
+        self._page = None
+        self.alternate_urls = None
+
+    def __getstate__(self):
+        # The page is not stored in the cache, it's fetched again on demand.
+        return dict(
+            (name, getattr(self, name)) for name in self.__slots__
+            if name not in ('_page', '_cached_children', 'alternate_urls') and hasattr(self, name)
+        )
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._page = None
+        self.alternate_urls = None
+
+    @property
+    def has_children(self):
+        # Same as PageNavigationNode, this checks that rght = lft + 1
+        return self.rght - self.lft > 1
+
+    @property
+    def _mptt_meta(self):
+        from fluent_pages.models import UrlNode
+        return UrlNode._mptt_meta
+
+    @property
+    def page(self):
+        """
+        Provide access to the underlying page object. This performs a query on first access.
+        """
+        if self._page is None:
+            from fluent_pages.models import UrlNode
+            self._page = UrlNode.objects.get(pk=self.pk)
+        return self._page
+
+
+def get_compact_nodes(top_pages, child_pages):
+    """
+    Convert the menu pages into a tree of :class:`CompactNavigationNode` objects.
+    The *child_pages* is a dictionary with the list of child pages for each page ID.
+    """
+    def _get_nodes(pages, parent_node):
+        nodes = []
+        for page in pages:
+            node = CompactNavigationNode(page, parent_node=parent_node)
+            node.children = _get_nodes(child_pages.get(page.pk, ()), node)
+            nodes.append(node)
+        return nodes
+
+    return _get_nodes(top_pages, None)
+
+
+def mark_active_nodes(nodes, current_page):
+    """
+    Update the active state of the :class:`CompactNavigationNode` objects for the current page.
+    """
+    for node in nodes:
+        node.is_active = current_page is not None and node.pk == current_page.pk
+        node.is_child_active = current_page is not None \
+            and node.tree_id == current_page.tree_id \
+            and node.level < current_page.level
+        mark_active_nodes(node.children, current_page)
@@ -5,6 +5,10 @@ import django
 from django.contrib.sites.models import Site
 from django.db import models
 from django.db.models.query import QuerySet
+from future.utils import iteritems
+
+if django.VERSION >= (1, 8):
+    from django.db.models import Case, Value, When
 
 
 def prefill_parent_site(page):
@@ -18,6 +22,84 @@ def prefill_parent_site(page):
             page.parent_site = current_site  # Fill the ORM cache.
 
 
+class PageIdentityMap(object):
+    """
+    The pages that were fetched during a single request, by their ID.
+
+    Pages that are added receive an ``_identity_map`` attribute,
+    so their parent can be found here instead of fetching it again.
+    When another instance of the same page is added, both instances share the translations that were fetched.
+    """
+
+    def __init__(self):
+        self._pages = {}
+
+    def __contains__(self, pk):
+        return pk in self._pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, pk, default=None):
+        """
+        Return the page with the given ID, if it was fetched.
+        """
+        return self._pages.get(pk, default)
+
+    def add(self, page):
+        """
+        Register a fetched page.
+        """
+        if page.pk is None:
+            return
+
+        page._identity_map = self
+        existing = self._pages.setdefault(page.pk, page)
+        if existing is not page:
+            _share_translations(existing, page)
+
+
+def _share_translations(page, other):
+    # Let both objects use the same translations cache, which has the translations of both.
+    for model, translations in list(iteritems(other._translations_cache)):
+        shared = page._translations_cache[model]
+        for language_code, translation in iteritems(translations):
+            shared.setdefault(language_code, translation)
+        other._translations_cache[model] = shared
+
+
+def get_identity_map(request):
+    """
+    Return the :class:`PageIdentityMap` of the request.
+    """
+    try:
+        return request._fluent_page_identity_map
+    except AttributeError:
+        request._fluent_page_identity_map = PageIdentityMap()
+        return request._fluent_page_identity_map
+
+
+def batch_update(queryset, field_name, values, batch_size=500):
+    """
+    Update a single field of many objects, using one ``UPDATE .. CASE`` statement per batch.
+
+    :param values: A dictionary of primary key to the new field value.
+    """
+    items = list(iteritems(values))
+    if django.VERSION < (1, 8):
+        # No conditional expressions available, update each row instead.
+        for pk, value in items:
+            queryset.filter(pk=pk).update(**{field_name: value})
+        return
+
+    output_field = queryset.model._meta.get_field(field_name)
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        queryset.filter(pk__in=[pk for pk, value in batch]).update(**{
+            field_name: Case(*[When(pk=pk, then=Value(value)) for pk, value in batch], output_field=output_field)
+        })
+
+
 # Based on django-queryset-transform.
 # This object however, operates on a per-object instance
 # without breaking the result generators
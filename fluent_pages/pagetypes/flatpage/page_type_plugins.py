@@ -9,6 +9,7 @@ class FlatPagePlugin(PageTypePlugin):
     model = FlatPage
     model_admin = FlatPageAdmin
     sort_priority = 11
+    prefetch_translations = ('seo_translations',)
 
     def get_render_template(self, request, flatpage, **kwargs):
         return flatpage.template_name
@@ -10,6 +10,7 @@ class FluentPagePlugin(FluentContentsPagePlugin):
     model = FluentPage
     model_admin = FluentPageAdmin
     sort_priority = 10
+    select_related = ('layout',)
 
     def get_render_template(self, request, fluentpage, **kwargs):
         # Allow subclasses to easily override it by specifying `render_template` after all.
@@ -0,0 +1,421 @@
+"""
+In-process routing table for the page dispatcher.
+
+Resolving a page normally requires a query on the translations table,
+followed by a query to fetch the polymorphic page object.
+When :ref:`FLUENT_PAGES_ROUTING_TABLE` is enabled, the URLs of all nodes are kept in memory instead,
+so a page can be resolved with a single primary key fetch of the concrete model.
+This includes the sub URLs of pages that provide URL patterns (e.g. a blog or shop),
+which are matched against the URLs of all path levels.
+
+Without the in-process table, the dispatcher can still use :func:`get_path_routing_table`,
+which fetches all candidate entries for a single request path in one query.
+
+Paths which returned a 404 page can be remembered in the :class:`NotFoundCache`,
+which uses the same version number to forget all entries when pages change.
+Likewise, the :class:`ResponseCache` stores the rendered output of page types
+that define a :attr:`~fluent_pages.extensions.PageTypePlugin.cache_timeout`.
+
+The table is loaded with a single query, and tagged with the cache version of the site (see :mod:`fluent_pages.cache`).
+Each time an URL changes, :func:`~fluent_pages.cache.expire_site_caches` increments that number,
+so all processes rebuild their table on the next request.
+"""
+from collections import OrderedDict
+from hashlib import md5
+from threading import Event, Lock
+from time import time
+
+from django.core.cache import cache
+from django.utils.cache import cc_delim_re
+from django.utils.encoding import force_bytes
+from django.utils.timezone import now
+from fluent_pages import appsettings
+from fluent_pages.cache import _get_site_id, get_cache_key, get_cache_version, get_content_version
+from future.builtins import object
+from future.utils import iteritems
+
+# Several imports in this file are placed inline, to avoid loading the models too early.
+
+__all__ = (
+    'RouteEntry',
+    'RoutingTable',
+    'get_routing_table',
+    'get_path_routing_table',
+    'get_path_candidates',
+    'get_next_publication_change',
+    'NotFoundCache',
+    'not_found_cache',
+    'ResponseCache',
+    'response_cache',
+)
+
+_tables = {}
+_build_lock = Lock()
+
+
+class RouteEntry(object):
+    """
+    The lightweight data of a node, stored in the routing table.
+    """
+    __slots__ = ('node_id', 'polymorphic_ctype_id', 'level', 'status', 'publication_date', 'publication_end_date')
+
+    def __init__(self, node_id, polymorphic_ctype_id, level, status, publication_date, publication_end_date):
+        self.node_id = node_id
+        self.polymorphic_ctype_id = polymorphic_ctype_id
+        self.level = level
+        self.status = status
+        self.publication_date = publication_date
+        self.publication_end_date = publication_end_date
+
+    def __repr__(self):
+        return '<{0}: #{1}>'.format(self.__class__.__name__, self.node_id)
+
+    def is_visible(self, for_user=None):
+        """
+        Tell whether the node would be returned by :func:`UrlNodeQuerySet.published() <fluent_pages.models.UrlNodeQuerySet.published>`.
+        """
+        from fluent_pages.models import UrlNode
+        if for_user is not None and for_user.is_staff:
+            return True
+
+        current_time = now()
+        return self.status == UrlNode.PUBLISHED \
+            and (self.publication_date is None or self.publication_date < current_time) \
+            and (self.publication_end_date is None or self.publication_end_date >= current_time)
+
+
+class RoutingTable(object):
+    """
+    The mapping of ``(language_code, _cached_url)`` to the :class:`RouteEntry` of a node.
+    """
+
+    def __init__(self, site_id, generation, paths=None, language_codes=None):
+        self.site_id = site_id
+        self.generation = generation
+        self.paths = paths
+        self.language_codes = language_codes
+        self._entries = {}
+        self._app_entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """
+        Fill the table with a single query.
+        When :attr:`paths` or :attr:`language_codes` are given, only those entries are loaded.
+        """
+        from fluent_pages.models import UrlNode_Translation
+        qs = UrlNode_Translation.objects.all()
+        if self.site_id is not None:
+            qs = qs.filter(master__parent_site=self.site_id)
+        if self.paths is not None:
+            qs = qs.filter(_cached_url__in=self.paths)
+        if self.language_codes is not None:
+            qs = qs.filter(language_code__in=self.language_codes)
+
+        entries = {}
+        nodes = {}
+        for language_code, cached_url, node_id, ctype_id, level, status, pub_date, pub_end_date in qs.values_list(
+                'language_code', '_cached_url',
+                'master_id', 'master__polymorphic_ctype_id', 'master__level', 'master__status',
+                'master__publication_date', 'master__publication_end_date'):
+            if not cached_url:
+                continue
+
+            # Share the same entry between all translations of a node.
+            try:
+                entry = nodes[node_id]
+            except KeyError:
+                entry = nodes[node_id] = RouteEntry(node_id, ctype_id, level, status, pub_date, pub_end_date)
+
+            entries[(language_code, cached_url)] = entry
+
+        self._entries = entries
+        self._app_entries = {}
+
+    def get(self, path, language_code):
+        """
+        Return the :class:`RouteEntry` for the path, or ``None`` when it's not found.
+        """
+        return self._entries.get((language_code, path))
+
+    def best_match(self, path, language_code, for_user=None):
+        """
+        Return the :class:`RouteEntry` of the page with custom URL patterns that is the closest parent of the path.
+        This mirrors :func:`UrlNodeQuerySet.best_match_for_path() <fluent_pages.models.UrlNodeQuerySet.best_match_for_path>`,
+        and returns ``None`` when no page is found.
+        """
+        from fluent_pages.models.managers import split_path_levels
+        app_entries = self._get_app_entries(language_code)
+        if not app_entries:
+            return None
+
+        best = None
+        best_order = None
+        for prefix in split_path_levels(path):
+            entry = app_entries.get(prefix)
+            if entry is not None and entry.is_visible(for_user=for_user):
+                # Same ordering as the database query; '/' and '/news/' are both level 0.
+                order = (entry.level, len(prefix))
+                if best is None or order > best_order:
+                    best = entry
+                    best_order = order
+        return best
+
+    def _get_app_entries(self, language_code):
+        # The index of mounted pages is built on demand, as only few requests need it.
+        try:
+            return self._app_entries[language_code]
+        except KeyError:
+            from fluent_pages.extensions import page_type_pool
+            url_types = set(page_type_pool.get_url_pattern_types())
+            app_entries = dict(
+                (cached_url, entry)
+                for (lang, cached_url), entry in iteritems(self._entries)
+                if lang == language_code and entry.polymorphic_ctype_id in url_types
+            )
+            self._app_entries[language_code] = app_entries
+            return app_entries
+
+
+def get_next_publication_change(site_id=None):
+    """
+    Return the first moment at which a page of the site is published or hidden by its publication dates,
+    or ``None`` when no changes are scheduled.
+    The value is cached until a page of the site is saved, or the moment has passed.
+    """
+    from django.db.models import Min
+    from fluent_pages.models import UrlNode
+    site_id = _get_site_id(site_id)
+    key = get_cache_key('next_publication_change', site_id=site_id)
+    current_time = now()
+
+    moment = cache.get(key)
+    if moment is None or (moment and moment <= current_time):
+        qs = UrlNode.objects.non_polymorphic().filter(status=UrlNode.PUBLISHED)
+        if site_id is not None:
+            qs = qs.filter(parent_site=site_id)
+
+        moments = [
+            qs.filter(publication_date__gt=current_time).aggregate(moment=Min('publication_date'))['moment'],
+            qs.filter(publication_end_date__gt=current_time).aggregate(moment=Min('publication_end_date'))['moment'],
+        ]
+        moments = [m for m in moments if m is not None]
+        moment = min(moments) if moments else False  # Also cache that there is nothing scheduled.
+        cache.set(key, moment)
+
+    return moment or None
+
+
+def get_path_candidates(path):
+    """
+    Return all paths that the dispatcher could look up for the given path:
+    the path itself, the path with an appended slash, and all parent paths.
+    """
+    from fluent_pages.models.managers import split_path_levels
+    paths = set(split_path_levels(path))
+    paths.add(path)
+    if not path.endswith('/'):
+        paths.add(path + '/')
+    return paths
+
+
+def get_path_routing_table(path, language_code, site_id=None):
+    """
+    Return a routing table that only contains the entries which could resolve the given path.
+    This table is fetched in a single query, and covers the active language and its fallbacks.
+    """
+    language_codes = appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices(language_code)
+    table = RoutingTable(_get_site_id(site_id), None, paths=get_path_candidates(path), language_codes=language_codes)
+    table.load()
+    return table
+
+
+class NotFoundCache(object):
+    """
+    A bounded in-process cache of paths that returned a 404 page.
+
+    The entries are tied to the current cache version of the site,
+    so they become invalid as soon as any page URL or publication status changes.
+    """
+
+    def __init__(self, max_size=1000, timeout=60):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _get_key(self, site_id, language_code, path, urlconf=None):
+        site_id = _get_site_id(site_id)
+        return (site_id, get_cache_version(site_id), language_code, path, urlconf)
+
+    def contains(self, site_id, language_code, path, urlconf=None):
+        """
+        Tell whether the path is known to be a 404 page.
+        """
+        key = self._get_key(site_id, language_code, path, urlconf)
+        with self._lock:
+            expires = self._items.pop(key, None)
+            if expires is None or expires < time():
+                return False
+
+            # Move to the end, these are the last entries to be purged.
+            self._items[key] = expires
+            return True
+
+    def add(self, site_id, language_code, path, urlconf=None):
+        """
+        Register that the path returns a 404 page.
+        """
+        key = self._get_key(site_id, language_code, path, urlconf)
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = time() + self.timeout
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class ResponseCache(object):
+    """
+    A cache of the rendered responses of pages, stored in the Django cache.
+
+    The keys include the cache version and content version of the site,
+    so the cached responses of a site are no longer used as soon as a page is saved or deleted.
+    When multiple requests miss the cache for the same path, only the first one renders the page;
+    the others wait for that response to be stored.
+    """
+
+    def __init__(self, key_prefix='response', wait_timeout=10):
+        self.key_prefix = key_prefix
+        self.wait_timeout = wait_timeout
+        self._pending = {}
+        self._lock = Lock()
+
+    def get_key(self, site_id, language_code, path, query_string=''):
+        """
+        Return the base key for a path, which is passed to the other methods.
+        The query string is part of the key, as pages could display different content for each parameter.
+        """
+        if query_string:
+            path = u'{0}?{1}'.format(path, query_string)
+        return get_cache_key(
+            self.key_prefix, get_content_version(site_id), language_code, md5(force_bytes(path)).hexdigest(), site_id=site_id
+        )
+
+    def _get_variant_key(self, request, key, headers):
+        # Same approach as Django's cache middleware; the headers are "learned" when the response is stored.
+        values = md5()
+        for header in headers:
+            values.update(force_bytes(request.META.get('HTTP_' + header.upper().replace('-', '_'), '')))
+            values.update(b'\n')
+        return '{0}.{1}'.format(key, values.hexdigest())
+
+    def get(self, request, key):
+        """
+        Return the cached response, or ``None`` when it's not found.
+        """
+        headers = cache.get(key + '.headers')
+        if headers is None:
+            return None
+        return cache.get(self._get_variant_key(request, key, headers))
+
+    def acquire(self, key):
+        """
+        Claim the rendering of a response.
+        This returns ``True`` when the caller should render the page, and call :func:`set` or :func:`release` afterwards.
+        When another request is rendering the page already, this waits for it and returns ``False``.
+        """
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None or pending[1] < time():
+                # The timeout also recovers from a request that never finished rendering.
+                self._pending[key] = (Event(), time() + self.wait_timeout)
+                return True
+
+        pending[0].wait(self.wait_timeout)
+        return False
+
+    def release(self, key):
+        """
+        Let the waiting requests continue.
+        """
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending[0].set()
+
+    def set(self, request, key, response, timeout, vary_headers=()):
+        """
+        Store the response once it's rendered, and release the key afterwards.
+        """
+        def _store(response):
+            response.__dict__.pop('render', None)  # Undo _release_on_error(), the method can't be pickled.
+            try:
+                headers = list(vary_headers)
+                if response.has_header('Vary'):
+                    headers.extend(cc_delim_re.split(response['Vary']))
+
+                # Don't share responses that contain a CSRF token or set cookies for a single visitor.
+                if '*' not in headers and not response.cookies and not request.META.get('CSRF_COOKIE_USED'):
+                    headers = sorted(set(header.lower() for header in headers))
+                    cache.set(key + '.headers', headers, timeout)
+                    cache.set(self._get_variant_key(request, key, headers), response, timeout)
+            finally:
+                self.release(key)
+
+        if callable(getattr(response, 'render', None)) and not response.is_rendered:
+            response.add_post_render_callback(_store)
+            self._release_on_error(response, key)
+        else:
+            _store(response)
+
+    def _release_on_error(self, response, key):
+        # The post-render callbacks don't run when the template raises an exception,
+        # the waiting requests would otherwise be blocked until the wait timeout.
+        render = response.render
+
+        def _render():
+            try:
+                return render()
+            except Exception:
+                response.__dict__.pop('render', None)
+                self.release(key)
+                raise
+
+        response.render = _render
+
+
+def get_routing_table(site_id=None):
+    """
+    Return the routing table of the current site, (re)building it when needed.
+    """
+    site_id = _get_site_id(site_id)
+
+    generation = get_cache_version(site_id)
+    table = _tables.get(site_id)
+    if table is None or table.generation != generation:
+        with _build_lock:
+            table = _tables.get(site_id)
+            if table is None or table.generation != generation:
+                table = RoutingTable(site_id, generation)
+                table.load()
+                _tables[site_id] = table
+    return table
+
+
+#: The global cache of 404 paths, or ``None`` when :ref:`FLUENT_PAGES_NOT_FOUND_CACHE_SIZE` is zero.
+not_found_cache = NotFoundCache(
+    max_size=appsettings.FLUENT_PAGES_NOT_FOUND_CACHE_SIZE,
+    timeout=appsettings.FLUENT_PAGES_NOT_FOUND_CACHE_TIMEOUT,
+) if appsettings.FLUENT_PAGES_NOT_FOUND_CACHE_SIZE else None
+
+#: The global cache of rendered responses, used by page types that define a :attr:`~fluent_pages.extensions.PageTypePlugin.cache_timeout`.
+response_cache = ResponseCache()
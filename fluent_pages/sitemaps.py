@@ -28,13 +28,13 @@ class PageSitemap(Sitemap):
         """
         Return all items of the sitemap.
         """
-        # Note that .active_translations() can't be combined with other filters for translations__.. fields.
+        # The languages are filtered without joining the translations table, hence each page is listed once.
         return (UrlNode.objects
                 .in_sitemaps()
                 .non_polymorphic()
-                .active_translations()
-                .prefetch_related('translations')
-                .order_by('level', 'translations__language_code', 'translations___cached_url')
+                .active_stored_translations()
+                .prefetch_active_translations()
+                .order_by('level', 'tree_id', 'lft')
                 )
 
     def lastmod(self, urlnode):
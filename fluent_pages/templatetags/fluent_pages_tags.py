@@ -6,16 +6,25 @@ Load this module using:
 
     {% load fluent_pages_tags %}
 """
+import django
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.query import prefetch_related_objects
 from django.template import Library, TemplateSyntaxError
 from django.utils.functional import SimpleLazyObject
+from fluent_pages import appsettings
+from fluent_pages.cache import get_cache_key
+from fluent_pages.menus import get_menu_renderer
 from fluent_pages.models import UrlNode
-from fluent_pages.models.navigation import PageNavigationNode
-from fluent_pages.models.utils import prefill_parent_site
+from fluent_pages.models.managers import _prime_translations
+from fluent_pages.models.navigation import CompactNavigationNode, NavigationNode, PageNavigationNode, get_compact_nodes, mark_active_nodes
+from fluent_pages.models.utils import get_identity_map, prefill_parent_site
+from fluent_pages.urlresolvers import PageKeyNotFound, get_key_link
 from future.builtins import str
 from six import integer_types, iteritems, string_types
 from tag_parser import template_tag
-from tag_parser.basetags import BaseInclusionNode, BaseNode
+from tag_parser.basetags import BaseAssignmentNode, BaseAssignmentOrOutputNode, BaseInclusionNode, BaseNode
 
 register = Library()
 
@@ -48,7 +57,7 @@ class BreadcrumbNode(BaseInclusionNode):
             page = None
             site = None
         else:
-            items = page.breadcrumb  # list(UrlNode)
+            items = self.get_breadcrumb_items(page)  # list(UrlNode), or list(CompactNavigationNode) when cached.
             site = SimpleLazyObject(lambda: page.parent_site),  # Only read if really used, then cache.
 
         return {
@@ -59,6 +68,27 @@ class BreadcrumbNode(BaseInclusionNode):
             'site': site,
         }
 
+    def get_breadcrumb_items(self, page):
+        """
+        Return the breadcrumb of the page. When :ref:`FLUENT_PAGES_MENU_CACHE_TIMEOUT` is set,
+        it's cached as :class:`~fluent_pages.models.navigation.CompactNavigationNode` objects.
+
+        Unlike :attr:`UrlNode.breadcrumb <fluent_pages.models.UrlNode.breadcrumb>`,
+        the parent pages are base :class:`~fluent_pages.models.UrlNode` objects, which are fetched in a single query.
+        """
+        if not appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT:
+            return _get_breadcrumb(page)
+
+        # Any change in the pages increments the cache version, which makes the previous entries unreachable.
+        cachekey = get_cache_key('breadcrumb', page.pk, page.get_current_language())
+        items = cache.get(cachekey)
+        if items is None:
+            items = [CompactNavigationNode(node) for node in _get_breadcrumb(page)]
+            cache.set(cachekey, items, appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT)
+
+        mark_active_nodes(items, page)
+        return items
+
 
 def get_node_kwargs(tag_kwargs):
     """
@@ -84,15 +114,29 @@ class MenuNode(BaseInclusionNode):
     template_name = 'fluent_pages/parts/menu.html'
     allowed_kwargs = ('max_depth', 'template', 'parent')
 
+    def render_tag(self, context, *tag_args, **tag_kwargs):
+        # The default template can be replaced by a Python renderer, see FLUENT_PAGES_MENU_RENDERER.
+        renderer = get_menu_renderer(self.get_template_name(*tag_args, **tag_kwargs))
+        if renderer is None:
+            return super(MenuNode, self).render_tag(context, *tag_args, **tag_kwargs)
+
+        data = self.get_context_data(context, *tag_args, **tag_kwargs)
+        return renderer.render(data['menu_items'])
+
     def get_context_data(self, parent_context, *tag_args, **tag_kwargs):
         # Get page objects
         request = _get_request(parent_context)
         user = request.user
+        identity_map = get_identity_map(request)
         try:
             current_page = _get_current_page(parent_context)
         except UrlNode.DoesNotExist:
             current_page = None
 
+        node_kwargs = get_node_kwargs(tag_kwargs)
+        max_depth = int(node_kwargs.get('max_depth', 9999))
+        child_pages = None
+
         if 'parent' in tag_kwargs:
             # if we've been provided a parent kwarg then we want to filter
             parent_value = tag_kwargs['parent']
@@ -103,29 +147,224 @@ class MenuNode(BaseInclusionNode):
                     parent = UrlNode.objects.get_for_path(parent_value)
                 except UrlNode.DoesNotExist:
                     return {'menu_items': []}
-                top_pages = parent.children.in_navigation(for_user=user)  # Can't do parent___cached_key due to polymorphic queryset code.
+                top_pages, child_pages = self.get_menu_pages(parent, max_depth, user, identity_map=identity_map)
             elif isinstance(parent_value, integer_types):
                 # If we've been provided an int then we lookup based on the id of the page
-                top_pages = UrlNode.objects.in_navigation(for_user=user).filter(parent_id=parent_value)
+                top_pages = UrlNode.objects.in_navigation(for_user=user).filter(parent_id=parent_value).using_identity_map(identity_map)
             elif isinstance(parent_value, UrlNode):
                 # If we've been given a Page or UrlNode then there's no lookup necessary
-                top_pages = parent_value.children.in_navigation(for_user=user)
+                top_pages, child_pages = self.get_menu_pages(parent_value, max_depth, user, identity_map=identity_map)
             else:
                 raise TemplateSyntaxError("The 'render_menu' tag only allows an URL path, page id or page object for the 'parent' keyword")
+        elif appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT:
+            # The top level menu is the same for all pages, so it can be cached.
+            menu_items = self.get_cached_menu_items(current_page, max_depth, user)
+            mark_active_nodes(menu_items, current_page)
+            return {
+                'parent': parent_context,
+                'request': request,
+                'menu_items': menu_items,
+            }
         else:
             # otherwise get the top level nav for the current page
             top_pages = UrlNode.objects.toplevel_navigation(current_page=current_page, for_user=user)
+            top_pages, child_pages = self.get_menu_pages(None, max_depth, user, top_pages=top_pages, identity_map=identity_map)
+
+        if child_pages is not None:
+            _mark_current_pages(top_pages, child_pages, current_page)
 
         # Construct a PageNavigationNode for every page, that allows simple iteration of the tree.
-        node_kwargs = get_node_kwargs(tag_kwargs)
         return {
             'parent': parent_context,
             'request': request,
             'menu_items': [
-                PageNavigationNode(page, current_page=current_page, for_user=user, **node_kwargs) for page in top_pages
+                PageNavigationNode(page, current_page=current_page, for_user=user, child_pages=child_pages, **node_kwargs) for page in top_pages
             ]
         }
 
+    def get_cached_menu_items(self, current_page, max_depth, for_user):
+        """
+        Return the top level menu as :class:`~fluent_pages.models.navigation.CompactNavigationNode` objects,
+        which are cached for :ref:`FLUENT_PAGES_MENU_CACHE_TIMEOUT` seconds.
+        """
+        # Any change in the pages increments the cache version, which makes the previous entries unreachable.
+        cachekey = get_cache_key(
+            'menu',
+            UrlNode.objects._get_navigation_language(current_page),
+            int(bool(for_user is not None and for_user.is_staff)),
+            max_depth,
+        )
+        menu_items = cache.get(cachekey)
+        if menu_items is None:
+            top_pages = UrlNode.objects.toplevel_navigation(current_page=current_page, for_user=for_user)
+            top_pages, child_pages = self.get_menu_pages(None, max_depth, for_user, top_pages=top_pages)
+            menu_items = get_compact_nodes(top_pages, child_pages)
+            cache.set(cachekey, menu_items, appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT)
+        return menu_items
+
+    def get_menu_pages(self, parent, max_depth, for_user, top_pages=None, identity_map=None):
+        """
+        Fetch the menu pages below the parent in a single query, limited by the *max_depth*.
+        Returns the top pages, and a dictionary with the child pages of each page ID.
+        The pages are registered in the *identity_map* of the request, if given.
+        """
+        if parent is None:
+            # The top pages determine which trees are visible (e.g. translated in the current language).
+            # The menu of the toplevel navigation is not polymorphic, hence the children aren't either.
+            # Since the top pages are root nodes, their descendants are found by the tree_id.
+            top_level = 0
+            qs = UrlNode.objects.in_navigation(for_user=for_user).non_polymorphic().filter(
+                Q(pk__in=top_pages.values('pk')) |
+                Q(tree_id__in=top_pages.values('tree_id'), level__gt=top_level, level__lt=top_level + max_depth)
+            )
+        else:
+            top_level = parent.level + 1
+            qs = UrlNode.objects.in_navigation(for_user=for_user).filter(
+                tree_id=parent.tree_id,
+                lft__gt=parent.lft,
+                rght__lt=parent.rght,
+                level__lt=top_level + max_depth,
+            )
+
+        # The query is ordered by tree_id and lft, so all children are added in the menu ordering.
+        # Nodes below a page that is hidden from the menu are skipped, as their parent is not part of the menu.
+        menu_pages = []
+        child_pages = {}
+        visible_pages = []
+        visible_ids = set()
+        for page in qs.using_identity_map(identity_map):
+            if page.level == top_level:
+                menu_pages.append(page)
+            elif page.parent_id in visible_ids:
+                child_pages.setdefault(page.parent_id, []).append(page)
+            else:
+                continue
+            visible_ids.add(page.pk)
+            visible_pages.append(page)
+
+        # The translations are only fetched for the pages that are displayed.
+        # The menu only displays the active language, unless all translations are requested.
+        if appsettings.FLUENT_PAGES_PREFETCH_TRANSLATIONS is True:
+            if django.VERSION >= (1, 10):
+                prefetch_related_objects(visible_pages, 'translations')
+            else:
+                prefetch_related_objects(visible_pages, ['translations'])
+        else:
+            _prime_translations(visible_pages, appsettings.FLUENT_PAGES_LANGUAGES.get_active_choices())
+
+        return menu_pages, child_pages
+
+
+def _mark_current_pages(top_pages, child_pages, current_page):
+    current_id = current_page.pk if current_page is not None else None
+    for page in top_pages:
+        page.is_current = (page.pk == current_id)
+    for children in child_pages.values():
+        for page in children:
+            page.is_current = (page.pk == current_id)
+
+
+@template_tag(register, 'get_alternate_urls')
+class AlternateUrlsNode(BaseAssignmentNode):
+    """
+    Return the URLs of the current page in each language, e.g. to render ``<link rel="alternate" hreflang="..">`` tags.
+
+    .. code-block:: html+django
+
+        {% get_alternate_urls as page_urls %}
+        {% for language_code, url in page_urls.items %}
+            <link rel="alternate" hreflang="{{ language_code }}" href="{{ url }}" />
+        {% endfor %}
+
+    Menu items (or pages) can be passed as arguments, their URLs are read in the same query
+    and stored in the ``alternate_urls`` attribute of each item:
+
+    .. code-block:: html+django
+
+        {% get_alternate_urls page menu_items as page_urls %}
+        {% for item in menu_items %}
+            {% for language_code, url in item.alternate_urls.items %}...{% endfor %}
+        {% endfor %}
+    """
+    min_args = 0
+    max_args = None
+
+    def get_value(self, context, *tag_args, **tag_kwargs):
+        if tag_args:
+            page = tag_args[0]
+            items = []
+            for arg in tag_args[1:]:
+                # Both separate menu items and lists of items can be given.
+                if isinstance(arg, (UrlNode, NavigationNode)):
+                    items.append(arg)
+                else:
+                    items.extend(arg)
+        else:
+            try:
+                page = _get_current_page(context)
+            except UrlNode.DoesNotExist:
+                page = None
+            items = ()
+
+        nodes = [(node, _get_page_id(node)) for node in _iter_loaded_nodes(items)]
+        page_ids = [page_id for node, page_id in nodes if page_id is not None]
+        if isinstance(page, UrlNode) and page.pk:
+            page_ids.append(page.pk)
+
+        urls = UrlNode.objects.absolute_urls_for(page_ids)
+        for node, page_id in nodes:
+            node.alternate_urls = urls.get(page_id, {})
+
+        return urls.get(page.pk, {}) if isinstance(page, UrlNode) else {}
+
+
+@template_tag(register, 'page_url_for_key')
+class PageUrlForKeyNode(BaseAssignmentOrOutputNode):
+    """
+    Return the URL of the page with the given key, e.g. for links in the footer.
+    The keys of all published pages are cached together, so this doesn't run any queries.
+
+    .. code-block:: html+django
+
+        <a href="{% page_url_for_key "terms" %}">...</a>
+
+    Like the ``{% url .. as var %}`` syntax, the assigned value is empty when the page doesn't exist.
+    """
+    min_args = 1
+    max_args = 1
+
+    def render_tag(self, context, *tag_args, **tag_kwargs):
+        if self.as_var:
+            try:
+                context[self.as_var] = self.get_value(context, *tag_args, **tag_kwargs)
+            except PageKeyNotFound:
+                context[self.as_var] = ''
+            return u''
+        return self.get_value(context, *tag_args, **tag_kwargs)
+
+    def get_value(self, context, *tag_args, **tag_kwargs):
+        return get_key_link(tag_args[0]).url
+
+
+@template_tag(register, 'get_page_link_for_key')
+class PageLinkForKeyNode(BaseAssignmentNode):
+    """
+    Return the ID, URL and title of the page with the given key, or ``None`` when the page doesn't exist.
+
+    .. code-block:: html+django
+
+        {% get_page_link_for_key "terms" as terms %}
+        {% if terms %}<a href="{{ terms.url }}">{{ terms.title }}</a>{% endif %}
+    """
+    min_args = 1
+    max_args = 1
+
+    def get_value(self, context, *tag_args, **tag_kwargs):
+        try:
+            return get_key_link(tag_args[0])
+        except PageKeyNotFound:
+            return None
+
 
 @template_tag(register, 'get_fluent_page_vars')
 class GetVarsNode(BaseNode):
@@ -200,10 +439,43 @@ def _get_current_page(context):
 
         prefill_parent_site(current_page)
         request._current_fluent_page = current_page
+        get_identity_map(request).add(current_page)
 
     return request._current_fluent_page  # is a UrlNode
 
 
+def _iter_loaded_nodes(nodes):
+    """
+    Walk through the navigation nodes, including the children that don't need a query.
+    """
+    for node in nodes:
+        yield node
+        if isinstance(node, CompactNavigationNode) or getattr(node, '_child_pages', None) is not None:
+            for child in _iter_loaded_nodes(node.children):
+                yield child
+
+
+def _get_breadcrumb(page):
+    """
+    Return the ancestors of the page with their translations, and the page itself.
+    """
+    return page._get_translated_ancestors() + [page]
+
+
+def _get_page_id(node):
+    """
+    Return the ID of the page of a menu item, or page.
+    """
+    if isinstance(node, UrlNode):
+        return node.pk
+    elif isinstance(node, CompactNavigationNode):
+        # Reading the page would perform a query, the ID is part of the cached node.
+        return node.pk
+    else:
+        page = node.page
+        return page.pk if page is not None else None
+
+
 def _get_request(context):
     """
     Fetch the request from the context.
@@ -220,3 +492,6 @@ if False and __debug__:
     register.tag('render_breadcrumb', BreadcrumbNode)
     register.tag('render_menu', MenuNode)
     register.tag('get_fluent_page_vars', GetVarsNode)
+    register.tag('get_alternate_urls', AlternateUrlsNode)
+    register.tag('page_url_for_key', PageUrlForKeyNode)
+    register.tag('get_page_link_for_key', PageLinkForKeyNode)
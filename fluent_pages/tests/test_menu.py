@@ -1,5 +1,7 @@
+import pickle
+
 from fluent_pages.models import Page
-from fluent_pages.models.navigation import PageNavigationNode
+from fluent_pages.models.navigation import CompactNavigationNode, PageNavigationNode, get_compact_nodes, mark_active_nodes
 from fluent_pages.tests.testapp.models import SimpleTextPage
 from fluent_pages.tests.utils import AppTestCase
 
@@ -77,8 +79,9 @@ class MenuTests(AppTestCase):
         self.assertEqual(menu[1].slug, 'root2')
 
         self.assertNumQueries(0, lambda: menu[0].has_children)
-        self.assertNumQueries(1, lambda: list(menu[0].children))
+        self.assertNumQueries(2, lambda: list(menu[0].children))  # pages, active translations
         self.assertNumQueries(0, lambda: list(menu[1].children))
+        self.assertNumQueries(0, lambda: [child.title for child in menu[0].children])
 
         self.assertEqual(menu[0].has_children, True)
         self.assertEqual(menu[1].has_children, False)
@@ -96,3 +99,39 @@ class MenuTests(AppTestCase):
 
         self.assertEqual(children[0].is_active, True)
         self.assertEqual(children[1].is_active, False)
+        self.assertIs(list(menu[0].children)[0], children[0])
+
+    def test_compact_menu_items(self):
+        """
+        The compact nodes offer the same API, and can be pickled.
+        """
+        current_page = Page.objects.get(translations__slug='level1a')
+        top_pages = list(Page.objects.toplevel_navigation())
+        child_pages = {top_pages[0].pk: list(top_pages[0].children.in_navigation())}
+
+        menu = pickle.loads(pickle.dumps(get_compact_nodes(top_pages, child_pages)))
+        self.assertIsInstance(menu[0], CompactNavigationNode)
+        self.assertFalse(hasattr(menu[0], '__dict__'))
+
+        # Test structure
+        self.assertEqual(menu[0].slug, 'home')
+        self.assertEqual(menu[0].title, 'Home')
+        self.assertEqual(menu[1].url, '/root2/')
+        self.assertEqual(menu[0].has_children, True)
+        self.assertEqual(menu[1].has_children, False)
+
+        children = list(menu[0].children)
+        self.assertEqual([child.slug for child in children], ['level1a', 'level1b'])
+        self.assertIs(children[0].parent, menu[0])
+        self.assertEqual(menu[0].parent, None)
+
+        # Test active states
+        mark_active_nodes(menu, current_page)
+        self.assertEqual(menu[0].is_active, False)
+        self.assertEqual(menu[0].is_child_active, True)
+        self.assertEqual(children[0].is_active, True)
+        self.assertEqual(children[1].is_active, False)
+
+        # The page is fetched on demand, only once.
+        self.assertEqual(children[0].page, current_page)
+        self.assertNumQueries(0, lambda: children[0].page)
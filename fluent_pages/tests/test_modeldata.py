@@ -1,10 +1,17 @@
 import django
+from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.encoding import force_text
-from fluent_pages.models import HtmlPage, Page, ParentTranslationDoesNotExist, UrlNode
+from django.utils.six import StringIO
+from fluent_pages.cache import expire_site_caches, get_cache_key, get_content_version
+from fluent_pages.models import HtmlPage, Page, ParentTranslationDoesNotExist, UrlNode, UrlNode_Translation
 from fluent_pages.models.fields import PageTreeForeignKey
 from fluent_pages.models.managers import UrlNodeManager, UrlNodeQuerySet
+from fluent_pages.routing import get_routing_table
 from fluent_pages.tests.testapp.models import PlainTextFile, SimpleTextPage, WebShopPage
 from fluent_pages.tests.utils import AppTestCase
 
@@ -70,6 +77,61 @@ class ModelDataTests(AppTestCase):
         self.assertRaises(Page.DoesNotExist, lambda: Page.objects.best_match_for_path('level1/level2/'))
         self.assertRaises(Page.DoesNotExist, lambda: Page.objects.best_match_for_path('level1/level2'))
 
+    def test_prefetch_active_translations(self):
+        """
+        Only the translations of the active languages should be fetched, including the missing ones.
+        """
+        qs = Page.objects.filter(pk__in=[self.root.pk, self.root2.pk]).non_polymorphic().prefetch_active_translations()
+        with self.assertNumQueries(2):
+            pages = list(qs)
+            self.assertEqual([page.title for page in pages], ["Home", "Root2"])
+            self.assertFalse(pages[0].has_translation('en'))
+
+        # Other languages are still read from the database.
+        with self.assertNumQueries(1):
+            self.assertFalse(pages[0].has_translation('nl'))
+
+    def test_translated_languages(self):
+        """
+        The languages of a node should be stored, so these can be filtered without joining the translations.
+        """
+        page = SimpleTextPage.objects.get(pk=self.root2.pk)
+        language_code = page.get_current_language()
+        self.assertEqual(page._translated_languages, u',{0},'.format(language_code))
+
+        page.set_current_language('nl')
+        page.title = "Wortel2"
+        page.slug = 'wortel2'
+        page.save()
+        self.assertEqual(UrlNode.objects.filter(pk=page.pk).values_list('_translated_languages', flat=True)[0], u',{0},nl,'.format(language_code))
+
+        qs = Page.objects.stored_translations('nl')
+        self.assertNotIn('JOIN', str(qs.query))
+        self.assertEqual(list(qs.values_list('pk', flat=True)), [page.pk])
+        self.assertIn('JOIN', str(Page.objects.translated('nl').query))
+        self.assertEqual(list(Page.objects.translated('nl').values_list('pk', flat=True)), [page.pk])
+
+        page.delete_translation('nl')
+        self.assertEqual(page._translated_languages, u',{0},'.format(language_code))
+        self.assertFalse(Page.objects.stored_translations('nl').exists())
+
+        # Translations that are saved without the node also store the language.
+        page.translations.create(language_code='nl', title="Wortel2", slug='wortel2', _cached_url='/wortel2/')
+        self.assertEqual(page._translated_languages, u',{0},nl,'.format(language_code))
+        self.assertTrue(Page.objects.stored_translations('nl').exists())
+
+        page.delete_translation('nl')
+        UrlNode_Translation(master_id=page.pk, language_code='nl', title="Wortel2", slug='wortel2', _cached_url='/wortel2/').save()
+        self.assertTrue(Page.objects.stored_translations('nl').exists())
+
+        # Changes that bypass the models are repaired by rebuild_page_tree.
+        UrlNode_Translation.objects.filter(master=page.pk, language_code='nl').delete()
+        self.assertTrue(Page.objects.stored_translations('nl').exists())
+        self.assertFalse(Page.objects.translated('nl').exists())
+        call_command('rebuild_page_tree', stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(Page.objects.stored_translations('nl').exists())
+        self.assertEqual(UrlNode.objects.filter(pk=page.pk).values_list('_translated_languages', flat=True)[0], u',{0},'.format(language_code))
+
     def test_split_path_levels(self):
         """
         Test the splitting of URL paths, which is the core of best_match_for_path()
@@ -168,6 +230,33 @@ class ModelDataTests(AppTestCase):
         self.assertEqual(level1.get_absolute_url(), '/level1_b/')
         self.assertEqual(level2.get_absolute_url(), '/level1_b/level2/')
 
+    def test_rename_slug_subtree(self):
+        """
+        Renaming a slug should update all decendants in a fixed number of queries.
+        """
+        level2 = SimpleTextPage.objects.get(translations__slug='level2')
+        children = [
+            SimpleTextPage.objects.create(title="Child", slug="child{0}".format(i), parent=level2, status=SimpleTextPage.PUBLISHED, author=self.user)
+            for i in range(5)
+        ]
+
+        # Make sure the translations are cached by django-parler, these should be refreshed.
+        self.assertEqual(SimpleTextPage.objects.get(pk=children[0].pk).get_absolute_url(), '/level1/level2/child0/')
+
+        level1 = SimpleTextPage.objects.get(translations__slug='level1')
+        level1.slug = 'level1_c'
+        with CaptureQueriesContext(connection) as context:
+            level1.save()
+
+        # One update for the page itself, and a single batch update for all decendants.
+        updates = [q['sql'] for q in context.captured_queries if q['sql'].startswith('UPDATE') and 'translation' in q['sql']]
+        self.assertEqual(len(updates), 2)
+
+        self.assertUrls(SimpleTextPage.objects.get(pk=level2.pk), {'en-us': u'/level1_c/level2/'})
+        for i, child in enumerate(children):
+            self.assertUrls(child, {'en-us': u'/level1_c/level2/child{0}/'.format(i)})
+        self.assertEqual(SimpleTextPage.objects.get(pk=children[0].pk).get_absolute_url(), '/level1_c/level2/child0/')
+
     def test_change_parent(self):
         """
         Moving a tree to a new parent should update their URLs
@@ -281,6 +370,118 @@ class ModelDataTests(AppTestCase):
         page5.save()
         self.assertEqual(page5.slug, 'dup-slug-5')
 
+    def test_unique_slugs(self):
+        """
+        The slugs of many new pages can be reserved in a single query.
+        """
+        SimpleTextPage.objects.create(slug='news', parent=self.root, author=self.user)
+        SimpleTextPage.objects.create(slug='news-2', parent=self.root, author=self.user)
+        SimpleTextPage.objects.language('nl').create(slug='news-3', author=self.user)
+
+        with self.assertNumQueries(1):
+            slugs = UrlNode.objects.unique_slugs(['news', 'level1', 'news', 'other', 'other'], parent=self.root)
+        self.assertEqual(slugs, ['news-3', 'level1-2', 'news-4', 'other', 'other-2'])
+
+        # Slugs are unique per parent and language, and the page itself can be excluded.
+        self.assertEqual(UrlNode.objects.unique_slugs(['level2', 'news'], parent=self.level1), ['level2-2', 'news'])
+        self.assertEqual(UrlNode.objects.unique_slugs(['level2'], parent=self.level1, exclude=self.level2.pk), ['level2'])
+        self.assertEqual(UrlNode.objects.unique_slugs(['news-3'], parent=None), ['news-3'])
+        self.assertEqual(UrlNode.objects.unique_slugs(['news-3'], parent=None, language_code='nl'), ['news-3-2'])
+
+    def test_bulk_import(self):
+        """
+        A complete tree can be imported at once, with tree fields, slugs and URLs calculated in memory.
+        """
+        def new_page(slug, **kwargs):
+            return SimpleTextPage(title=slug.title(), slug=slug, status=SimpleTextPage.PUBLISHED, author=self.user, **kwargs)
+
+        pages = UrlNode.objects.bulk_import([
+            (new_page('level2'), [
+                (new_page('news'), []),
+                (new_page('news'), [
+                    (new_page('item'), []),
+                ]),
+            ]),
+            (new_page('readme'), []),
+        ], parent=self.level1)
+
+        self.assertEqual([page.slug for page in pages], ['level2-2', 'news', 'news-2', 'item', 'readme'])
+        self.assertUrls(pages[2], {'en-us': u'/level1/level2-2/news-2/'})
+        self.assertUrls(pages[3], {'en-us': u'/level1/level2-2/news-2/item/'})
+        self.assertUrls(pages[4], {'en-us': u'/level1/readme/'})
+
+        # The tree structure is consistent with the existing nodes.
+        level1 = SimpleTextPage.objects.get(pk=self.level1.pk)
+        self.assertEqual(
+            [page.slug for page in level1.get_descendants()],
+            ['level2', 'level2-2', 'news', 'news-2', 'item', 'readme']
+        )
+        self.assertEqual(Page.objects.get_for_path('/level1/level2-2/news-2/item/'), pages[3])
+        self.assertEqual(list(pages[0].get_children()), [pages[1], pages[2]])
+        self.assertEqual(SimpleTextPage.objects.get(pk=self.root2.pk).lft, 1)
+
+        # Adding new root nodes also works, and saving afterwards doesn't move the node.
+        roots = UrlNode.objects.bulk_import([(new_page('root2'), [(new_page('sub'), [])])])
+        self.assertUrls(roots[1], {'en-us': u'/root2-2/sub/'})
+        roots[1].save()
+        self.assertEqual(SimpleTextPage.objects.get(pk=roots[1].pk).parent_id, roots[0].pk)
+        self.assertEqual(roots[1].get_absolute_url(), '/root2-2/sub/')
+
+    def test_rebuild_page_tree(self):
+        """
+        The rebuild_page_tree command should restore all cached URLs.
+        """
+        UrlNode_Translation.objects.filter(master__in=[self.level1.pk, self.level2.pk]).update(_cached_url='/broken/')
+        UrlNode_Translation.objects.filter(master=self.level1.pk).update(slug='level1_b')
+
+        stdout = StringIO()
+        call_command('rebuild_page_tree', stdout=stdout, stderr=StringIO(), **{'batch-size': 1})
+        self.assertUrls(self.level1, {'en-us': u'/level1_b/'})
+        self.assertUrls(self.level2, {'en-us': u'/level1_b/level2/'})
+        self.assertUrls(self.root, {'en-us': u'/'})
+        self.assertIn("UPDATED from /broken/", stdout.getvalue())
+        self.assertIn("2 of 6 URLs updated", stdout.getvalue())
+
+    def test_cache_version(self):
+        """
+        Saving a page, or expiring the site caches should make all cache keys unreachable.
+        """
+        key = get_cache_key('test', 'en')
+        self.assertTrue(key.startswith('fluent_pages.test.{0}.v'.format(settings.SITE_ID)))
+        self.assertEqual(get_cache_key('test', 'en'), key)
+
+        expire_site_caches()
+        key2 = get_cache_key('test', 'en')
+        self.assertNotEqual(key2, key)
+
+        # Saving a page without changing the URLs or menu only expires the rendered content.
+        content_version = get_content_version()
+        root = SimpleTextPage.objects.get(pk=self.root.pk)
+        root.save()
+        self.assertEqual(get_cache_key('test', 'en'), key2)
+        self.assertNotEqual(get_content_version(), content_version)
+
+        root.in_navigation = not root.in_navigation
+        root.save()
+        key3 = get_cache_key('test', 'en')
+        self.assertNotEqual(key3, key2)
+
+        root.title = "Root2"
+        root.save()
+        key4 = get_cache_key('test', 'en')
+        self.assertNotEqual(key4, key3)
+
+        # Deleting a translation removes its URL.
+        root.set_current_language('nl')
+        root.title = "Wortel"
+        root.slug = 'wortel'
+        root.save()
+        self.assertIsNotNone(get_routing_table().get('/wortel/', 'nl'))
+        key5 = get_cache_key('test', 'en')
+        root.delete_translation('nl')
+        self.assertNotEqual(get_cache_key('test', 'en'), key5)
+        self.assertIsNone(get_routing_table().get('/wortel/', 'nl'))
+
     def test_file_model_urls(self):
         """
         When a plugin type is marked as "file" behave accordingly.
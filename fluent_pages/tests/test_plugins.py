@@ -1,8 +1,12 @@
 import django
+from django.core.urlresolvers import NoReverseMatch
 from django.test import override_settings
+from django.utils.translation import get_language
+from fluent_pages.models import PageLayout
+from fluent_pages.pagetypes.fluentpage.models import FluentPage
 from fluent_pages.tests.testapp.models import WebShopPage
 from fluent_pages.tests.utils import AppTestCase
-from fluent_pages.urlresolvers import MultipleReverseMatch, PageTypeNotMounted, app_reverse, mixed_reverse
+from fluent_pages.urlresolvers import MultipleReverseMatch, PageTypeNotMounted, _get_mount_points, _is_app_only_name, app_reverse, mixed_reverse
 
 
 class PluginTests(AppTestCase):
@@ -31,6 +35,19 @@ class PluginTests(AppTestCase):
         match = resolver.resolve('/')
         self.assertEqual(match.func, webshop_index)
 
+    def test_query_hints(self):
+        """
+        The query hints of a page type should fetch the related data together with the page.
+        """
+        layout = PageLayout.objects.create(key='default', title="Default", template_path='testapp/base.html')
+        page = FluentPage.objects.create(title="Fluent", slug="fluent", status=FluentPage.PUBLISHED, author=self.user, layout=layout, meta_keywords="foo")
+
+        qs = page.plugin.apply_query_hints(FluentPage.objects.all(), language_codes=['nl', get_language()])
+        with self.assertNumQueries(2):  # page with layout, SEO translations
+            page = qs.get(pk=page.pk)
+            self.assertEqual(page.layout.key, 'default')
+            self.assertEqual(page.meta_keywords, "foo")
+
     # TODO: test more stuff.
     # e.g. registration API, supported fields, expected available API functions
 
@@ -46,6 +63,39 @@ class PluginTests(AppTestCase):
         self.assertEqual(mixed_reverse('webshop_index'), '/shop/')
         self.assertEqual(mixed_reverse('webshop_article', kwargs={'slug': 'foobar'}), '/shop/foobar/')
 
+    def test_app_reverse_index(self):
+        """
+        The app_reverse function should only try the plugins that define the view name.
+        """
+        from fluent_pages.extensions import page_type_pool
+        from fluent_pages.tests.testapp.page_type_plugins import WebShopPagePlugin
+        self.assertEqual([plugin.__class__ for plugin in page_type_pool.get_url_pattern_plugins('webshop_index')], [WebShopPagePlugin])
+        self.assertEqual(page_type_pool.get_url_pattern_plugins('not_found'), [])
+        self.assertTrue(_is_app_only_name('webshop_index'))
+        self.assertFalse(_is_app_only_name('admin:index'))
+
+        self.assertRaises(NoReverseMatch, lambda: app_reverse('not_found'))
+        self.assertRaises(NoReverseMatch, lambda: mixed_reverse('not_found'))
+
+    def test_app_reverse_cache(self):
+        """
+        The mount points of a page type should be cached, without fetching page objects.
+        """
+        self.assertEqual(app_reverse('webshop_index'), '/shop/')
+        with self.assertNumQueries(0):
+            self.assertEqual(app_reverse('webshop_article', kwargs={'slug': 'foobar'}), '/shop/foobar/')
+
+        # The mount points are only a list of page ids and URLs.
+        mount_points = _get_mount_points(WebShopPage)
+        self.assertEqual(len(mount_points), 1)
+        self.assertEqual(list(mount_points[0][1].values()), ['/shop/'])
+
+        # Saving a page resets the cache
+        shop = WebShopPage.objects.get()
+        shop.slug = 'shop-new'
+        shop.save()
+        self.assertEqual(app_reverse('webshop_index'), '/shop-new/')
+
     def test_app_reverse_multiple(self):
         """
         The app_reverse functions should support multiple mount points for an app.
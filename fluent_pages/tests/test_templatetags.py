@@ -1,7 +1,27 @@
 import re
 
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.template import Context, Template
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from fluent_pages import appsettings
+from fluent_pages.menus import MenuRenderer, get_menu_renderer
+from fluent_pages.models import UrlNode
+from fluent_pages.models.navigation import NavigationNode, PageNavigationNode
+from fluent_pages.models.utils import get_identity_map
+from fluent_pages.templatetags.fluent_pages_tags import BreadcrumbNode, MenuNode
 from fluent_pages.tests.testapp.models import SimpleTextPage
 from fluent_pages.tests.utils import AppTestCase
+from fluent_pages.urlresolvers import PageKeyNotFound, key_reverse
+
+
+class VirtualNavigationNode(NavigationNode):
+    """
+    A menu item that is not backed by a page.
+    """
+    children = ()
 
 
 class TemplateTagTests(AppTestCase):
@@ -11,6 +31,11 @@ class TemplateTagTests(AppTestCase):
     root_url = '/'
     subpage1_url = '/test_subpage1/'
 
+    def setUp(self):
+        # Need to make sure that django-parler's cache isn't reused,
+        # because the transaction is rolled back on each test method.
+        cache.clear()
+
     @classmethod
     def setUpTree(cls):
         root = SimpleTextPage.objects.create(title="Home", slug="home", status=SimpleTextPage.PUBLISHED, author=cls.user, override_url='/')
@@ -33,3 +58,243 @@ class TemplateTagTests(AppTestCase):
                          """{'title':"Level1b','url':"/level1b/",'active':false},"""
                          """]},"""
                          """{'title':"Root2','url':"/root2/",'active':false},]""")
+
+    def _render_menu(self, max_depth=2):
+        request = RequestFactory().get('/level1a/')
+        request.user = AnonymousUser()
+        page = SimpleTextPage.objects.get(translations__slug='level1a')
+        template = Template('{{% load fluent_pages_tags %}}{{% render_menu max_depth={0} %}}'.format(max_depth))
+        with CaptureQueriesContext(connection) as context:
+            html = template.render(Context({'request': request, 'page': page}))
+        return html, context.captured_queries
+
+    def test_render_menu_single_query(self):
+        """
+        The pages of all menu levels are fetched in a single query.
+        """
+        level1a = SimpleTextPage.objects.get(translations__slug='level1a')
+        SimpleTextPage.objects.create(title="Level2", slug="level2", parent=level1a, status=SimpleTextPage.PUBLISHED, author=self.user)
+
+        html, queries = self._render_menu(max_depth=3)
+        self.assertIn('<a href="/level1a/level2/">Level2</a>', html)
+        self.assertIn('<a href="/level1b/">Level1b</a>', html)
+        page_queries = [q for q in queries if 'FROM "fluent_pages_urlnode"' in q['sql']]
+        self.assertEqual(len(page_queries), 1)
+
+        # Limited by the depth
+        html, queries = self._render_menu(max_depth=1)
+        self.assertNotIn('Level1a', html)
+        self.assertIn('<a href="/root2/">Root2</a>', html)
+
+    def test_render_menu_hidden_pages(self):
+        """
+        The pages below a page that is hidden from the menu are not read.
+        """
+        root = SimpleTextPage.objects.get(translations__slug='home')
+        hidden = SimpleTextPage.objects.create(title="Hidden", slug="hidden", parent=root, in_navigation=False,
+                                               status=SimpleTextPage.PUBLISHED, author=self.user)
+        SimpleTextPage.objects.create(title="Below hidden", slug="below-hidden", parent=hidden, status=SimpleTextPage.PUBLISHED, author=self.user)
+        hidden_root = SimpleTextPage.objects.create(title="Hidden root", slug="hidden-root", in_navigation=False,
+                                                    status=SimpleTextPage.PUBLISHED, author=self.user)
+        SimpleTextPage.objects.create(title="Below hidden root", slug="below-hidden-root", parent=hidden_root,
+                                      status=SimpleTextPage.PUBLISHED, author=self.user)
+
+        top_pages = UrlNode.objects.toplevel_navigation()
+        menu_pages, child_pages = MenuNode('render_menu').get_menu_pages(None, 9999, None, top_pages=top_pages)
+        self.assertEqual([page.slug for page in menu_pages], ['home', 'root2'])
+        self.assertEqual(list(child_pages.keys()), [root.pk])
+        self.assertEqual([page.slug for page in child_pages[root.pk]], ['level1a', 'level1b'])
+
+    def test_render_menu_cache(self):
+        """
+        The menu can be cached, until a page is saved.
+        """
+        appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT = 60
+        try:
+            self._render_menu()
+            html, queries = self._render_menu()
+            self.assertEqual(queries, [])
+            self.assertIn('<li class="active">', html)
+
+            level1b = SimpleTextPage.objects.get(translations__slug='level1b')
+            level1b.title = 'Level1b changed'
+            level1b.save()
+            html, queries = self._render_menu()
+            self.assertIn('<a href="/level1b/">Level1b changed</a>', html)
+        finally:
+            appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT = 0
+
+    def test_menu_renderer(self):
+        """
+        The Python menu renderer produces the same HTML as the default menu template.
+        """
+        level1a = SimpleTextPage.objects.get(translations__slug='level1a')
+        SimpleTextPage.objects.create(title="Level2 <&>", slug="level2", parent=level1a, status=SimpleTextPage.DRAFT, author=self.user)
+
+        request = RequestFactory().get('/level1a/')
+        request.user = self.user  # also sees the draft
+        template = Template(
+            '{% load fluent_pages_tags %}'
+            '{% render_menu max_depth=3 %}'
+            '{% render_menu parent="/level1a/" %}'
+            '{% render_menu parent="/404/" %}'
+            '{% render_menu max_depth=1 template="testapp/json_menu.html" %}'
+        )
+        expected = template.render(Context({'request': request, 'page': level1a}))
+        self.assertIn('<li class=" draft">', expected)
+        self.assertIn('Level2 &lt;&amp;&gt;', expected)
+
+        appsettings.FLUENT_PAGES_MENU_RENDERER = 'fluent_pages.menus.MenuRenderer'
+        try:
+            # Custom templates are still rendered as template.
+            self.assertIsInstance(get_menu_renderer('fluent_pages/parts/menu.html'), MenuRenderer)
+            self.assertIsNone(get_menu_renderer('testapp/json_menu.html'))
+            self.assertEqual(template.render(Context({'request': request, 'page': level1a})), expected)
+
+            # Also for the cached menu nodes
+            appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT = 60
+            self.assertEqual(template.render(Context({'request': request, 'page': level1a})), expected)
+        finally:
+            appsettings.FLUENT_PAGES_MENU_RENDERER = None
+            appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT = 0
+
+    def _render_breadcrumb(self, page):
+        request = RequestFactory().get(page.url)
+        request.user = AnonymousUser()
+        template = Template('{% load fluent_pages_tags %}{% render_breadcrumb %}')
+        with CaptureQueriesContext(connection) as context:
+            html = template.render(Context({'request': request, 'page': page}))
+        return html, context.captured_queries
+
+    def test_render_breadcrumb(self):
+        """
+        The ancestors are fetched together with their translations.
+        """
+        level1a = SimpleTextPage.objects.get(translations__slug='level1a')
+        level2 = SimpleTextPage.objects.create(title="Level2", slug="level2", parent=level1a, status=SimpleTextPage.PUBLISHED, author=self.user)
+        level3 = SimpleTextPage.objects.create(title="Level3", slug="level3", parent=level2, status=SimpleTextPage.PUBLISHED, author=self.user)
+
+        page = SimpleTextPage.objects.get(pk=level3.pk)
+        page.title  # read the translation of the page itself
+        html, queries = self._render_breadcrumb(page)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('<a href="/">Home</a>', html)
+        self.assertIn('<a href="/level1a/">Level1a</a>', html)
+        self.assertIn('<a href="/level1a/level2/">Level2</a>', html)
+        self.assertIn('<li class="last"><a href="/level1a/level2/level3/">Level3</a></li>', html)
+
+        # The tag reads base nodes, also when some are not translated in the active language.
+        # The breadcrumb property of the page still returns the page type models.
+        tag = BreadcrumbNode('render_breadcrumb')
+        self.assertEqual([type(node) for node in tag.get_breadcrumb_items(page)[:-1]], [UrlNode, UrlNode, UrlNode])
+        page = SimpleTextPage.objects.language('nl').get(pk=level3.pk)
+        self.assertEqual([type(node) for node in tag.get_breadcrumb_items(page)[:-1]], [UrlNode, UrlNode, UrlNode])
+        self.assertEqual([type(node) for node in page.breadcrumb], [SimpleTextPage] * 4)
+
+    def test_render_breadcrumb_cache(self):
+        """
+        The breadcrumb can be cached, until a page is saved.
+        """
+        appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT = 60
+        try:
+            page = SimpleTextPage.objects.get(translations__slug='level1a')
+            self._render_breadcrumb(page)
+            html, queries = self._render_breadcrumb(page)
+            self.assertEqual(queries, [])
+            self.assertIn('<a href="/">Home</a>', html)
+
+            root = SimpleTextPage.objects.get(translations__slug='home')
+            root.title = 'Home changed'
+            root.save()
+            page = SimpleTextPage.objects.get(pk=page.pk)
+            html, queries = self._render_breadcrumb(page)
+            self.assertIn('<a href="/">Home changed</a>', html)
+        finally:
+            appsettings.FLUENT_PAGES_MENU_CACHE_TIMEOUT = 0
+
+    def test_identity_map(self):
+        """
+        The pages that are fetched during a request are reused, instead of fetching them again.
+        """
+        level1a = SimpleTextPage.objects.get(translations__slug='level1a')
+        level2 = SimpleTextPage.objects.create(title="Level2", slug="level2", parent=level1a, status=SimpleTextPage.PUBLISHED, author=self.user)
+
+        page = SimpleTextPage.objects.get(pk=level2.pk)
+        request = RequestFactory().get(page.url)
+        request.user = AnonymousUser()
+        template = Template('{% load fluent_pages_tags %}{% render_breadcrumb %}{% render_menu %}')
+        template.render(Context({'request': request, 'page': page}))
+
+        identity_map = get_identity_map(request)
+        self.assertIn(page.pk, identity_map)
+        self.assertIn(level1a.pk, identity_map)
+
+        # The parents are found in the identity map, together with their translations.
+        with self.assertNumQueries(0):
+            self.assertEqual(page.parent.title, "Level1a")
+            self.assertEqual(page.parent.parent.title, "Home")
+            self.assertEqual(PageNavigationNode(page, current_page=page).parent.title, "Level1a")
+
+    def test_get_alternate_urls(self):
+        """
+        The URLs of the page and all menu items are read in a single query.
+        """
+        request = RequestFactory().get('/level1a/')
+        request.user = AnonymousUser()
+        page = SimpleTextPage.objects.get(translations__slug='level1a')
+        template = Template(
+            '{% load fluent_pages_tags %}'
+            '{% get_alternate_urls page menu_items as page_urls %}'
+            '{% for language_code, url in page_urls.items %}[{{ language_code }}:{{ url }}]{% endfor %}'
+            '{% for item in menu_items %}{% for child in item.children %}({{ child.alternate_urls.values|join:"," }}){% endfor %}{% endfor %}'
+        )
+
+        top_pages = list(UrlNode.objects.toplevel_navigation())
+        menu_items = [PageNavigationNode(top_page, current_page=page, child_pages={top_pages[0].pk: [page]}) for top_page in top_pages]
+        virtual_node = VirtualNavigationNode()  # Nodes without a page are skipped.
+        context = Context({'request': request, 'page': page, 'menu_items': menu_items + [virtual_node]})
+        with CaptureQueriesContext(connection) as queries:
+            html = template.render(context)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(html, u'[{0}:/level1a/](/level1a/)'.format(page.get_current_language()))
+        self.assertEqual(virtual_node.alternate_urls, {})
+
+        # The URLs are cached
+        with CaptureQueriesContext(connection) as queries:
+            template.render(context)
+        self.assertEqual(len(queries), 0)
+
+    def test_page_url_for_key(self):
+        """
+        The pages with a key can be linked to, without fetching the pages for every request.
+        """
+        page = SimpleTextPage.objects.get(translations__slug='level1b')
+        page.key = 'terms'
+        page.save()
+
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        template = Template(
+            '{% load fluent_pages_tags %}'
+            '<a href="{% page_url_for_key "terms" %}">'
+            '{% get_page_link_for_key "terms" as terms %}{{ terms.title }}</a>'
+            '{% page_url_for_key "privacy" as privacy_url %}[{{ privacy_url }}]'
+        )
+        html = template.render(Context({'request': request}))
+        self.assertEqual(html, u'<a href="/level1b/">Level1b</a>[]')
+
+        # The keys are cached
+        with self.assertNumQueries(0):
+            self.assertEqual(template.render(Context({'request': request})), html)
+            self.assertRaises(PageKeyNotFound, lambda: key_reverse('privacy'))
+
+        # Saving a page resets the cache
+        page.slug = 'terms'
+        page.save()
+        self.assertEqual(key_reverse('terms'), '/terms/')
+
+        # Assigning a key to an existing page also resets the cache
+        privacy = SimpleTextPage.objects.get(translations__slug='level1a')
+        privacy.key = 'privacy'
+        privacy.save()
+        self.assertEqual(key_reverse('privacy'), '/level1a/')
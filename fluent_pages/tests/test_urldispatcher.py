@@ -1,10 +1,21 @@
+from datetime import timedelta
+
 import django
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.urlresolvers import resolve, reverse
-from django.test import override_settings
+from django.http import Http404
+from django.template import TemplateDoesNotExist
+from django.test import RequestFactory, override_settings
+from django.utils.timezone import now
+from django.utils.translation import get_language
+from fluent_pages.extensions import page_type_pool
 from fluent_pages.models import Page, UrlNode
+from fluent_pages.routing import NotFoundCache, ResponseCache, get_next_publication_change, get_routing_table
 from fluent_pages.tests.testapp.models import PlainTextFile, SimpleTextPage, WebShopPage
 from fluent_pages.tests.utils import AppTestCase, script_name
-from fluent_pages.views.dispatcher import _get_fallback_language, _try_languages
+from fluent_pages.views.dispatcher import CmsPageDispatcher, _get_fallback_language, _is_accidental_fallback, _try_languages
 from future.builtins import str
 
 
@@ -128,6 +139,79 @@ class UrlDispatcherTests(AppTestCase):
         self.assertEqual(response.content.decode('utf-8'), str('This is the README'))
         self.assertEqual(response['Content-Type'], 'text/plain')
 
+    def test_conditional_get(self):
+        """
+        Pages should send an ETag and Last-Modified header, and answer conditional requests with a 304.
+        """
+        self.assertFalse(self.client.get('/sibling1/').has_header('ETag'))  # opt-in
+
+        plugin = page_type_pool.get_plugin_by_model(SimpleTextPage)
+        plugin.conditional_requests = True
+        try:
+            response = self.client.get('/sibling1/')
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            last_modified = response['Last-Modified']
+
+            self.assertEqual(self.client.get('/sibling1/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get('/sibling1/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            self.assertEqual(self.client.get('/sibling1/', HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+            self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+            # Saving the page changes the ETag.
+            page = SimpleTextPage.objects.get(pk=self.sibling1.pk)
+            page.save()
+            self.assertEqual(self.client.get('/sibling1/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+            # Saving another page also changes the ETag, it could be displayed in the menu.
+            etag = self.client.get('/sibling1/')['ETag']
+            Page.objects.get(pk=self.shop.pk).save()
+            self.assertEqual(self.client.get('/sibling1/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+            # Logged in users receive a different version.
+            etag = self.client.get('/sibling1/')['ETag']
+            self.client.force_login(self.user)
+            response = self.client.get('/sibling1/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('Last-Modified'))
+        finally:
+            del plugin.conditional_requests
+
+    def test_cache_control(self):
+        """
+        The max-age of a page should end when the publication status of a page changes.
+        """
+        plugin = page_type_pool.get_plugin_by_model(SimpleTextPage)
+        plugin.cache_max_age = 3600
+        try:
+            response = self.client.get('/sibling1/')
+            self.assertEqual(response['Cache-Control'], 'max-age=3600')
+
+            SimpleTextPage.objects.create(title="Scheduled", slug="scheduled", status=SimpleTextPage.PUBLISHED, author=self.user,
+                                          publication_date=now() + timedelta(seconds=600))
+            max_age = int(self.client.get('/sibling1/')['Cache-Control'].split('=')[1])
+            self.assertTrue(590 < max_age <= 600, max_age)
+            self.assertNumQueries(0, lambda: get_next_publication_change())
+
+            page = SimpleTextPage.objects.get(pk=self.sibling1.pk)
+            page.publication_end_date = now() + timedelta(seconds=60)
+            page.save()
+            max_age = int(self.client.get('/sibling1/')['Cache-Control'].split('=')[1])
+            self.assertTrue(50 < max_age <= 60, max_age)
+
+            # Files don't receive the header.
+            self.assertFalse(self.client.get('/README').has_header('Cache-Control'))
+
+            # Responses that contain a CSRF token can't be shared with other visitors.
+            request = RequestFactory().get('/sibling1/', CSRF_COOKIE_USED=True)
+            request.user = AnonymousUser()
+            response = CmsPageDispatcher.as_view()(request, path='sibling1/')
+            self.assertFalse(response.has_header('Cache-Control'))  # not known before rendering
+            response.render()
+            self.assertFalse(response.has_header('Cache-Control'))
+        finally:
+            del plugin.cache_max_age
+
     def test_unicode_404_internal(self):
         """
         Test the internal code that is used for a 404 page.
@@ -143,6 +227,58 @@ class UrlDispatcherTests(AppTestCase):
             lambda lang: qs.get_for_path(u'/foo/\xe9\u20ac\xdf\xed\xe0\xf8\xeb\xee\xf1\xfc/', language_code=lang)
         ))
 
+    def test_get_object_translations(self):
+        """
+        The page type model keeps its prefetched translations, and the missing translations the lookup found.
+        """
+        SimpleTextPage.objects.language('en').create(title="English", slug="english", status=SimpleTextPage.PUBLISHED, author=self.user)
+
+        request = RequestFactory().get('/english/')
+        request.user = AnonymousUser()
+        view = CmsPageDispatcher(request=request, args=(), kwargs={'path': 'english/'})
+        view.language_code = 'nl'
+        view.prefetch_translations = 'active'
+        with self.assertNumQueries(3):
+            page = view.get_object()
+            self.assertIsInstance(page, SimpleTextPage)
+            self.assertEqual(page.title, "English")
+            self.assertFalse(page.has_translation('nl'))
+
+    def test_get_for_path_languages(self):
+        """
+        The fallback language is resolved in the same query, including the missing translation.
+        """
+        languages = ['nl', get_language()]
+        with self.assertNumQueries(1):
+            sibling1 = Page.objects.non_polymorphic().get_for_path('/sibling1/', language_code=languages)
+            self.assertEqual(sibling1.get_current_language(), get_language())
+            self.assertFalse(sibling1.has_translation('nl'))
+
+        with self.assertNumQueries(1):
+            shop = Page.objects.non_polymorphic().url_pattern_types().best_match_for_path('/shop/foo/', language_code=languages)
+            self.assertEqual(shop.get_current_language(), get_language())
+
+        self.assertRaises(UrlNode.DoesNotExist, lambda: Page.objects.get_for_path('/not-found/', language_code=languages))
+
+        # The preferred language wins when both exist.
+        sibling1 = SimpleTextPage.objects.get(pk=self.sibling1.pk)
+        sibling1.set_current_language('nl')
+        sibling1.title = "Tekst1"
+        sibling1.slug = 'zuster1'
+        sibling1.save()
+
+        self.assertEqual(Page.objects.get_for_path('/zuster1/', language_code=languages).get_current_language(), 'nl')
+        self.assertTrue(Page.objects.get_for_path('/sibling1/', language_code=languages).has_translation('nl'))
+
+        # The matched language tells whether the fallback was used by accident, without querying the translations.
+        preferred = Page.objects.non_polymorphic().get_for_path('/zuster1/', language_code=languages)
+        fallback = Page.objects.non_polymorphic().get_for_path('/sibling1/', language_code=languages)
+        self.assertEqual(preferred._matched_language, 'nl')
+        self.assertEqual(fallback._matched_language, get_language())
+        with self.assertNumQueries(0):
+            self.assertFalse(_is_accidental_fallback(preferred, 'nl'))
+            self.assertTrue(_is_accidental_fallback(fallback, 'nl'))
+
     def test_unicode_404(self):
         """
         Urls with unicode characters should return proper 404 pages, not crash on it.
@@ -199,6 +335,193 @@ class UrlDispatcherTests(AppTestCase):
         self.assertEqual(reverse3, '/')
 
 
+class UrlDispatcherNotFoundCacheTests(AppTestCase):
+    """
+    Tests for remembering 404 pages.
+    """
+
+    @classmethod
+    def setUpTree(cls):
+        cls.home = SimpleTextPage.objects.create(title="Home", slug="home", status=SimpleTextPage.PUBLISHED, author=cls.user, override_url='/')
+
+    def setUp(self):
+        cache.clear()
+        self._old_cache = CmsPageDispatcher.not_found_cache
+        CmsPageDispatcher.not_found_cache = NotFoundCache(max_size=2, timeout=60)
+
+    def tearDown(self):
+        CmsPageDispatcher.not_found_cache = self._old_cache
+
+    def test_not_found_cache(self):
+        """
+        A known 404 page should not query the database again.
+        """
+        self.assert404('/not-found/')
+        self.assertEqual(len(CmsPageDispatcher.not_found_cache), 1)
+
+        request = RequestFactory().get('/not-found/')
+        request.user = AnonymousUser()
+        view = CmsPageDispatcher(request=request, args=(), kwargs={'path': 'not-found/'})
+        self.assertNumQueries(0, lambda: self.assertRaises(Http404, lambda: view.get(request)))
+
+        # Adding a page expires the cache.
+        SimpleTextPage.objects.create(title="Found", slug="not-found", status=SimpleTextPage.PUBLISHED, author=self.user)
+        self.assert200('/not-found/')
+
+    def test_not_found_cache_size(self):
+        """
+        The cache should only hold a limited number of paths.
+        """
+        self.assert404('/not-found1/')
+        self.assert404('/not-found2/')
+        self.assert404('/not-found3/')
+        self.assertEqual(len(CmsPageDispatcher.not_found_cache), 2)
+        language_code = get_language()
+        self.assertFalse(CmsPageDispatcher.not_found_cache.contains(None, language_code, '/not-found1/'))
+        self.assertTrue(CmsPageDispatcher.not_found_cache.contains(None, language_code, '/not-found3/'))
+
+
+class UrlDispatcherResponseCacheTests(AppTestCase):
+    """
+    Tests for caching the rendered output of pages.
+    """
+
+    @classmethod
+    def setUpTree(cls):
+        cls.sibling1 = SimpleTextPage.objects.create(title="Text1", slug="sibling1", status=SimpleTextPage.PUBLISHED, author=cls.user, contents="TEST_CONTENTS")
+
+    def setUp(self):
+        cache.clear()
+        self.plugin = page_type_pool.get_plugin_by_model(SimpleTextPage)
+        self.plugin.cache_timeout = 60
+        self._old_cache = CmsPageDispatcher.response_cache
+        CmsPageDispatcher.response_cache = ResponseCache(wait_timeout=1)
+
+    def tearDown(self):
+        del self.plugin.cache_timeout
+        if 'conditional_requests' in self.plugin.__dict__:
+            del self.plugin.conditional_requests
+        CmsPageDispatcher.response_cache = self._old_cache
+
+    def _get(self, path, user=None, method='get', **extra):
+        request = getattr(RequestFactory(), method)(path, **extra)
+        request.user = user or AnonymousUser()
+        path = path.split('?')[0].lstrip('/')
+        view = CmsPageDispatcher(request=request, args=(), kwargs={'path': path})
+        response = view.dispatch(request, path=path)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_response_cache(self):
+        """
+        The rendered page should be served without queries.
+        """
+        self.plugin.conditional_requests = True
+        response = self._get('/sibling1/')
+        self.assertContains(response, '<div id="test_contents">TEST_CONTENTS</div>')
+
+        with self.assertNumQueries(0):
+            response = self._get('/sibling1/')
+        self.assertContains(response, '<div id="test_contents">TEST_CONTENTS</div>')
+
+        # Conditional requests are also answered from the cache.
+        with self.assertNumQueries(0):
+            response = self._get('/sibling1/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Saving a page expires the cache.
+        page = SimpleTextPage.objects.get(pk=self.sibling1.pk)
+        page.contents = "NEW_CONTENTS"
+        page.save()
+        self.assertContains(self._get('/sibling1/'), '<div id="test_contents">NEW_CONTENTS</div>')
+
+    def test_response_cache_bypass(self):
+        """
+        Staff members and POST requests should not be served from the cache.
+        """
+        self._get('/sibling1/')
+        self.assertNumQueries(0, lambda: self._get('/sibling1/'))
+
+        with self.assertNumQueries(2):  # polymorphic query + translation
+            self._get('/sibling1/', user=self.user)
+        with self.assertNumQueries(2):
+            self._get('/sibling1/', method='post')
+
+    def test_response_cache_query_string(self):
+        """
+        Each query string is cached separately, as the page could display different content.
+        """
+        self._get('/sibling1/?page=1')
+        self.assertNumQueries(0, lambda: self._get('/sibling1/?page=1'))
+        with self.assertNumQueries(2):
+            self._get('/sibling1/?page=2')
+        with self.assertNumQueries(2):
+            self._get('/sibling1/')
+
+    def test_response_cache_vary_headers(self):
+        """
+        The cache key should include the headers the page depends on.
+        """
+        self.plugin.cache_vary_headers = ('Accept-Encoding',)
+        try:
+            self._get('/sibling1/')
+            self.assertNumQueries(0, lambda: self._get('/sibling1/'))
+
+            request = RequestFactory().get('/sibling1/', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertIsNone(CmsPageDispatcher.response_cache.get(request, CmsPageDispatcher.response_cache.get_key(
+                settings.SITE_ID, get_language(), '/sibling1/'
+            )))
+        finally:
+            del self.plugin.cache_vary_headers
+
+    def test_response_cache_not_cacheable(self):
+        """
+        Requests for pages that are not cached should not wait for each other.
+        """
+        from fluent_pages.tests.testapp.models import PlainTextFile
+        other_plugin = page_type_pool.get_plugin_by_model(PlainTextFile)
+        other_plugin.cache_timeout = 60  # keeps the response cache enabled
+        self.plugin.cache_timeout = 0
+        response_cache = CmsPageDispatcher.response_cache
+        acquired = []
+        response_cache.acquire = lambda key: acquired.append(key) or True
+        try:
+            self.assertContains(self._get('/sibling1/'), '<div id="test_contents">TEST_CONTENTS</div>')
+            self.assertEqual(acquired, [])
+
+            self.plugin.cache_timeout = 60
+            self._get('/sibling1/')
+            self.assertEqual(len(acquired), 1)
+        finally:
+            del other_plugin.cache_timeout
+
+    def test_response_cache_render_error(self):
+        """
+        When the template fails, other requests should not wait for the response.
+        """
+        self.plugin.render_template = 'testapp/not_found.html'
+        try:
+            self.assertRaises(TemplateDoesNotExist, lambda: self._get('/sibling1/'))
+            self.assertEqual(CmsPageDispatcher.response_cache._pending, {})
+        finally:
+            del self.plugin.render_template
+
+        # Once fixed, the response is cached again.
+        self._get('/sibling1/')
+        self.assertNumQueries(0, lambda: self._get('/sibling1/'))
+
+    def test_response_cache_acquire(self):
+        """
+        Only one request should render the page, others wait for it.
+        """
+        response_cache = ResponseCache(wait_timeout=0.1)
+        self.assertTrue(response_cache.acquire('test'))
+        self.assertFalse(response_cache.acquire('test'))  # waits until the timeout
+        response_cache.release('test')
+        self.assertTrue(response_cache.acquire('test'))
+
+
 class UrlDispatcherNonRootTests(AppTestCase):
     """
     Tests for URL resolving with a non-root URL include.
@@ -243,3 +566,156 @@ class UrlDispatcherNonRootTests(AppTestCase):
 
         self.assertRedirects(self.client.get('/pages/sibling1/@admin'), admin_url, status_code=302, target_status_code=target_status_code)
         self.assertRedirects(self.client.get('/pages/non-existent/@admin'), 'http://testserver/pages/non-existent/', status_code=302, target_status_code=404)
+
+
+class UrlDispatcherRoutingTableTests(AppTestCase):
+    """
+    Tests for URL resolving via the in-process routing table.
+    """
+
+    @classmethod
+    def setUpTree(cls):
+        cls.home = SimpleTextPage.objects.create(title="Home", slug="home", status=SimpleTextPage.PUBLISHED, author=cls.user, override_url='/')
+        cls.sibling1 = SimpleTextPage.objects.create(title="Text1", slug="sibling1", status=SimpleTextPage.PUBLISHED, author=cls.user, contents="TEST_CONTENTS")
+        cls.unpublished = SimpleTextPage.objects.create(title="Text1", slug="unpublished", status=SimpleTextPage.DRAFT, author=cls.user)
+        cls.readme = PlainTextFile.objects.create(slug='README', status=PlainTextFile.PUBLISHED, author=cls.user, content="This is the README")
+        cls.shop = WebShopPage.objects.create(title="Shop1", slug="shop", status=SimpleTextPage.PUBLISHED, author=cls.user)
+
+    dispatcher_setting = 'use_routing_table'
+    not_modified_queries = 0
+
+    def setUp(self):
+        # The routing table of a previous test can't be reused, because the transaction is rolled back on each test method.
+        cache.clear()
+        self._old_setting = getattr(CmsPageDispatcher, self.dispatcher_setting)
+        setattr(CmsPageDispatcher, self.dispatcher_setting, True)
+
+    def tearDown(self):
+        setattr(CmsPageDispatcher, self.dispatcher_setting, self._old_setting)
+
+    def _get_view(self, path):
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+        view = CmsPageDispatcher(request=request, args=(), kwargs={'path': path.lstrip('/')})
+        view.language_code = view.get_language()
+        return view
+
+    def test_routing_table_output(self):
+        """
+        Pages should be found via the routing table.
+        """
+        self.assert200('/')
+        self.assertContains(self.client.get('/sibling1/'), '<div id="test_contents">TEST_CONTENTS</div>')
+        self.assertEqual(self.client.get('/README').content.decode('utf-8'), str('This is the README'))
+        self.assert404('/unpublished/')
+        self.assert404('/not-found/')
+
+    def test_routing_table_queries(self):
+        """
+        Resolving a page only needs to fetch the concrete object.
+        """
+        self.assertNumQueries(1, lambda: get_routing_table())
+
+        view = self._get_view('/sibling1/')
+        with self.assertNumQueries(1):
+            page = view.get_object()
+        self.assertEqual(page, self.sibling1)
+        self.assertIsInstance(page, SimpleTextPage)
+
+        view = self._get_view('/not-found/')
+        self.assertNumQueries(0, lambda: self.assertRaises(UrlNode.DoesNotExist, lambda: view.get_object()))
+
+    def test_routing_table_not_modified(self):
+        """
+        A conditional request can be answered from the routing table, without fetching the page.
+        """
+        plugin = page_type_pool.get_plugin_by_model(SimpleTextPage)
+        plugin.conditional_requests = True
+        try:
+            etag = self.client.get('/sibling1/')['ETag']
+            get_routing_table()
+
+            request = RequestFactory().get('/sibling1/', HTTP_IF_NONE_MATCH=etag)
+            request.user = AnonymousUser()
+            view = CmsPageDispatcher(request=request, args=(), kwargs={'path': 'sibling1/'})
+            with self.assertNumQueries(self.not_modified_queries):
+                response = view.get(request)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        finally:
+            del plugin.conditional_requests
+
+    def test_routing_table_expire(self):
+        """
+        Changing the URL of a page should update the routing table.
+        """
+        self.assert200('/sibling1/')
+
+        sibling1 = SimpleTextPage.objects.get(pk=self.sibling1.pk)
+        sibling1.slug = 'sibling1-new'
+        sibling1.save()
+
+        self.assert404('/sibling1/')
+        self.assert200('/sibling1-new/')
+
+        # Publication changes are also picked up, even without loading translations.
+        unpublished = SimpleTextPage.objects.get(pk=self.unpublished.pk)
+        unpublished.status = SimpleTextPage.PUBLISHED
+        unpublished.save()
+        self.assert200('/unpublished/')
+
+    def test_routing_table_app_urls(self):
+        """
+        Pages with URL patterns should be found via the routing table.
+        """
+        self.assertContains(self.client.get('/shop/'), 'test_webshop: index_page')
+        self.assertContains(self.client.get('/shop/foobar/'), 'test_webshop: article: foobar')
+        self.assert404('/shop/article1/foo')
+
+        get_routing_table()
+        view = self._get_view('/shop/foobar/')
+        with self.assertNumQueries(1):
+            page = view.get_best_match_object()
+        self.assertEqual(page, self.shop)
+
+        # Normal pages don't have URL patterns.
+        view = self._get_view('/sibling1/foobar/')
+        self.assertNumQueries(0, lambda: self.assertRaises(UrlNode.DoesNotExist, lambda: view.get_best_match_object()))
+
+
+class UrlDispatcherSingleQueryTests(UrlDispatcherRoutingTableTests):
+    """
+    Tests for URL resolving, using a single query for all resolver functions.
+    """
+    dispatcher_setting = 'use_single_query'
+    not_modified_queries = 1
+
+    def test_routing_table_queries(self):
+        """
+        Resolving a page only needs a single lookup, even with a fallback language.
+        """
+        view = self._get_view('/sibling1/')
+        with self.assertNumQueries(2):
+            page = view.get_object()
+        self.assertEqual(page, self.sibling1)
+        self.assertIsInstance(page, SimpleTextPage)
+
+        view = self._get_view('/not-found/')
+        view.language_code = 'nl'
+        self.assertNumQueries(1, lambda: self.assertRaises(UrlNode.DoesNotExist, lambda: view.get_object()))
+
+    def test_routing_table_app_urls(self):
+        """
+        The exact match, the APPEND_SLASH check and the best match all share the same query.
+        """
+        self.assertContains(self.client.get('/shop/foobar/'), 'test_webshop: article: foobar')
+        with override_settings(APPEND_SLASH=True):
+            self.assertRedirects(self.client.get('/shop/article1'), '/shop/article1/', status_code=302)
+
+        view = self._get_view('/shop/foobar')
+        with self.assertNumQueries(1):
+            self.assertRaises(UrlNode.DoesNotExist, lambda: view.get_object())
+            self.assertRaises(UrlNode.DoesNotExist, lambda: view.get_object('/shop/foobar/'))
+        with self.assertNumQueries(1):
+            page = view.get_best_match_object()
+        self.assertEqual(page, self.shop)
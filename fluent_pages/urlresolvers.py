@@ -1,23 +1,40 @@
 """
 URL Resolving for dynamically added pages.
 """
+from collections import namedtuple
+
 from django.core.urlresolvers import NoReverseMatch, reverse
 from django.utils.functional import lazy
 from django.utils.translation import get_language
 from future.builtins import str
+from six import string_types
 
 # Several imports in this file are placed inline, to avoid loading the models too early.
 # Because fluent_pages.models creates a QuerySet, all all apps will be imported.
 # By reducing the import statements here, other apps (e.g. django-fluent-blogs) can already import this module safely.
 # Also, note that mixed_reverse_lazy() could be used from the Django settings file.
 
+# The view names which are not part of the URLconf, so mixed_reverse() can skip the standard reverse() call.
+_app_only_names = {}
+
+# The in-process copy of the cached mount points.
+_mount_points = {}
+
+# The in-process copy of the cached page keys.
+_key_maps = {}
+
 __all__ = (
     'MultipleReverseMatch',
     'PageTypeNotMounted',
+    'PageKeyNotFound',
+    'PageLink',
     'mixed_reverse',
     'mixed_reverse_lazy',
     'app_reverse',
     'app_reverse_lazy',
+    'key_reverse',
+    'key_reverse_lazy',
+    'get_key_link',
     'clear_app_reverse_cache',
 )
 
@@ -35,14 +52,28 @@ class PageTypeNotMounted(NoReverseMatch):
     """
 
 
+class PageKeyNotFound(NoReverseMatch):
+    """
+    Raised when the :func:`key_reverse` function can't find a published page with the given key.
+    """
+
+
+#: The page details returned by :func:`get_key_link`.
+PageLink = namedtuple('PageLink', ('page_id', 'url', 'title'))
+
+
 def mixed_reverse(viewname, args=None, kwargs=None, current_app=None, current_page=None, language_code=None, multiple=False, ignore_multiple=False):
     """
     Attempt to reverse a normal URLconf URL, revert to :func:`app_reverse` on errors.
     """
-    try:
-        return reverse(viewname, args=args, kwargs=kwargs, current_app=current_app)
-    except NoReverseMatch:
-        return app_reverse(viewname, args=args, kwargs=kwargs, multiple=multiple, ignore_multiple=ignore_multiple, current_page=current_page, language_code=language_code)
+    if not _is_app_only_name(viewname):
+        try:
+            return reverse(viewname, args=args, kwargs=kwargs, current_app=current_app)
+        except NoReverseMatch:
+            pass
+
+    return app_reverse(viewname, args=args, kwargs=kwargs, multiple=multiple, ignore_multiple=ignore_multiple,
+                       current_page=current_page, language_code=language_code)
 
 
 def app_reverse(viewname, args=None, kwargs=None, multiple=False, ignore_multiple=False, current_page=None, language_code=None):
@@ -54,7 +85,6 @@ def app_reverse(viewname, args=None, kwargs=None, multiple=False, ignore_multipl
     kwargs = kwargs or {}
 
     # Find the plugin
-    # TODO: allow more caching of the results
     plugin, url_end = _find_plugin_reverse(viewname, args, kwargs)
     pages = _get_pages_of_type(plugin.model, language_code=language_code)
 
@@ -62,31 +92,93 @@ def app_reverse(viewname, args=None, kwargs=None, multiple=False, ignore_multipl
         # Multiple results available.
         # If there is a current page, it can be used as base URL, otherwise bail out.
         if current_page and current_page.plugin is plugin:
-            for page in pages:
-                if page.pk == current_page.pk:
+            for page_id, url in pages:
+                if page_id == current_page.pk:
                     return current_page.get_absolute_url() + url_end
 
         raise MultipleReverseMatch("Reverse for application URL '{0}' found, but multiple root nodes available: {1}".format(
-            viewname, ', '.join(page.get_absolute_url() for page in pages)
+            viewname, ', '.join(url for page_id, url in pages)
         ))
     elif not pages:
         raise PageTypeNotMounted("Reverse for application URL '{0}' is not available, a '{1}' page needs to be added to the page tree.".format(viewname, str(plugin.verbose_name)))
 
     # Return URL with page prefix.
     if multiple:
-        return (page.get_absolute_url() + url_end for page in pages)
+        return (url + url_end for page_id, url in pages)
     else:
         # single result, or ignoring multiple results.
-        return pages[0].get_absolute_url() + url_end
+        return pages[0][1] + url_end
+
+
+def key_reverse(key, language_code=None):
+    """
+    Return the URL of the page with the given key, e.g. ``key_reverse('terms')``.
+    The key can be a slug-like value that was configured in ``FLUENT_PAGES_KEY_CHOICES``.
+    """
+    return get_key_link(key, language_code=language_code).url
+
+
+def get_key_link(key, language_code=None):
+    """
+    Return the ID, URL and title of the page with the given key, e.g. to render footer links.
+    When the page is not translated in the given language, the fallback language is used.
+
+    Unlike :func:`UrlNode.objects.get_for_key() <fluent_pages.models.UrlNodeManager.get_for_key>`,
+    this doesn't run any queries, as the keys of all published pages are cached together.
+    """
+    from django.utils import translation
+    from fluent_pages import appsettings
+    if language_code is None:
+        language_code = get_language()
+
+    try:
+        page_id, translations = _get_key_map()[key]
+    except KeyError:
+        raise PageKeyNotFound("Reverse for page key '{0}' not found, no published page has this key.".format(key))
+
+    fallback = appsettings.FLUENT_PAGES_LANGUAGES.get_fallback_language(language_code)
+    for found_language in (language_code, fallback):
+        if found_language in translations:
+            break
+    else:
+        raise PageKeyNotFound("Reverse for page key '{0}' not found, the page is not translated in '{1}'.".format(key, language_code))
+
+    cached_url, title = translations[found_language]
+    with translation.override(found_language):
+        root = reverse('fluent-page').rstrip('/')
+    return PageLink(page_id, root + cached_url, title)
 
 
 mixed_reverse_lazy = lazy(mixed_reverse, str)
 app_reverse_lazy = lazy(app_reverse, str)
+key_reverse_lazy = lazy(key_reverse, str)
+
+
+def _is_app_only_name(viewname):
+    """
+    Tell whether the view name only exists in the URL patterns of page types, not in the URLconf.
+    """
+    from django.conf import settings
+    from django.core.urlresolvers import get_resolver, get_urlconf
+    from fluent_pages.extensions import page_type_pool
+    if not isinstance(viewname, string_types) or ':' in viewname or '.' in viewname:
+        # Namespaced names and dotted paths are not found in the index.
+        return False
+
+    urlconf = get_urlconf() or settings.ROOT_URLCONF
+    key = (urlconf, viewname)
+    try:
+        return _app_only_names[key]
+    except KeyError:
+        is_app_only = bool(page_type_pool.get_url_pattern_plugins(viewname)) \
+            and viewname not in get_resolver(urlconf).reverse_dict
+        _app_only_names[key] = is_app_only
+        return is_app_only
 
 
 def _find_plugin_reverse(viewname, args, kwargs):
     from fluent_pages.extensions import page_type_pool
-    plugins = page_type_pool.get_url_pattern_plugins()
+    plugins = page_type_pool.get_url_pattern_plugins(viewname)
     for plugin in plugins:
         try:
             url_end = plugin.get_url_resolver().reverse(viewname, *args, **kwargs)
@@ -101,38 +193,126 @@ def _find_plugin_reverse(viewname, args, kwargs):
             ))
 
 
-def _get_pages_of_type(model, language_code=None):
+def _get_mount_points(model):
     """
-    Find where a given model is hosted.
+    Return the ``(page_id, {language_code: _cached_url})`` of all published pages of the given model.
+
+    This compact structure is cached until the pages of the site change, or a scheduled publication takes effect.
+    The current version is also kept in memory, so it doesn't have to be unpickled for every :func:`app_reverse` call.
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.utils.timezone import now
+    from fluent_pages.cache import get_cache_key, get_cache_version
+    site_id = settings.SITE_ID
+    current_time = now()
+    generation = get_cache_version(site_id)
+    memo = _mount_points.get((model, site_id))
+    if memo is not None and memo[0] == generation and (memo[1] is None or memo[1] > current_time):
+        return memo[2]
+
+    cachekey = get_cache_key('mount_points', model._meta.app_label, model._meta.model_name, site_id=site_id)
+    data = cache.get(cachekey)
+    if data is None or (data[0] is not None and data[0] <= current_time):
+        data = _load_mount_points(model, site_id)
+        cache.set(cachekey, data)
+
+    _mount_points[(model, site_id)] = (generation,) + data
+    return data[1]
+
+
+def _load_mount_points(model, site_id):
+    # Returns the moment at which the data expires, and the mount points.
+    from collections import OrderedDict
+    from fluent_pages.models.db import UrlNode, UrlNode_Translation
+    from fluent_pages.routing import get_next_publication_change
+    expires = get_next_publication_change(site_id)
+
+    pages = UrlNode.objects.published().non_polymorphic().instance_of(model)
+    rows = UrlNode_Translation.objects.filter(master__in=pages.values('pk')).order_by(
+        'master__tree_id', 'master__lft', 'language_code'
+    ).values_list('master_id', 'language_code', '_cached_url')
+
+    mount_points = OrderedDict()
+    for page_id, language_code, cached_url in rows:
+        mount_points.setdefault(page_id, {})[language_code] = cached_url
+
+    return expires, list(mount_points.items())
+
+
+def _get_key_map():
+    """
+    Return the ``{key: (page_id, {language_code: (_cached_url, title)})}`` of all published pages that have a key.
+    Like :func:`_get_mount_points`, this is cached until the pages of the site change.
     """
     from django.conf import settings
     from django.core.cache import cache
-    from fluent_pages.models.db import UrlNode
+    from django.utils.timezone import now
+    from fluent_pages.cache import get_cache_key, get_cache_version
+    site_id = settings.SITE_ID
+    current_time = now()
+    generation = get_cache_version(site_id)
+    memo = _key_maps.get(site_id)
+    if memo is not None and memo[0] == generation and (memo[1] is None or memo[1] > current_time):
+        return memo[2]
+
+    cachekey = get_cache_key('key_map', site_id=site_id)
+    data = cache.get(cachekey)
+    if data is None or (data[0] is not None and data[0] <= current_time):
+        data = _load_key_map(site_id)
+        cache.set(cachekey, data)
+
+    _key_maps[site_id] = (generation,) + data
+    return data[1]
+
+
+def _load_key_map(site_id):
+    # Returns the moment at which the data expires, and the keys.
+    from fluent_pages.models.db import UrlNode, UrlNode_Translation
+    from fluent_pages.routing import get_next_publication_change
+    expires = get_next_publication_change(site_id)
+
+    pages = UrlNode.objects.published().non_polymorphic().filter(key__isnull=False).exclude(key='')
+    rows = UrlNode_Translation.objects.filter(master__in=pages.values('pk')).values_list(
+        'master__key', 'master_id', 'language_code', '_cached_url', 'title'
+    )
+
+    key_map = {}
+    for key, page_id, language_code, cached_url, title in rows:
+        key_map.setdefault(key, (page_id, {}))[1][language_code] = (cached_url, title)
+
+    return expires, key_map
+
+
+def _get_pages_of_type(model, language_code=None):
+    """
+    Find where a given model is hosted.
+    This returns the ``(page_id, url)`` of each page, in the given language or its fallback.
+    """
+    from django.core.exceptions import ImproperlyConfigured
+    from django.utils import translation
+    from fluent_pages import appsettings
     if language_code is None:
         language_code = get_language()
 
-    cachekey = 'fluent_pages.instance_of.{0}.{1}'.format(model.__name__, settings.SITE_ID)
-    pages = cache.get(cachekey)
-    if not pages:
-        pages = UrlNode.objects.published().non_polymorphic().instance_of(model).only(
-            'parent', 'lft',  # add fields read by MPTT, otherwise .only() causes infinite loop in django-mptt 0.5.2
-            'id'              # for Django 1.3
-        )
+    mount_points = _get_mount_points(model)
+    if not mount_points:
+        return []
 
-        # Short cache time of 1 hour, take into account that the publication date can affect this value.
-        pages = list(pages)   # Make output consistent with non-cached version
-        cache.set(cachekey, pages, 3600)
+    # This is effectively what UrlNode.get_absolute_url() does, without fetching the pages.
+    with translation.override(language_code):
+        try:
+            root = reverse('fluent-page').rstrip('/')
+        except NoReverseMatch:
+            raise ImproperlyConfigured("Missing an include for 'fluent_pages.urls' in the URLConf")
 
-    # Return in desired language
-    # This is effectively what qs.language(..) does
+    # Filter the pages that are not available in the given language code.
+    fallback = appsettings.FLUENT_PAGES_LANGUAGES.get_fallback_language(language_code)
     result = []
-    for page in pages:
-        page.set_current_language(language_code)
-
-        # Filter the pages that are not available in the given language code.
-        # Currently not splitting the cached query, makes invalidation much harder.
-        if page.has_translation(language_code) or page.has_translation(page.get_fallback_language()):
-            result.append(page)
+    for page_id, cached_urls in mount_points:
+        cached_url = cached_urls.get(language_code) or cached_urls.get(fallback)
+        if cached_url:
+            result.append((page_id, root + cached_url))
 
     return result
 
@@ -142,7 +322,5 @@ def clear_app_reverse_cache():
     Clear the cache for the :func:`app_reverse` function.
     This only has to be called when doing bulk update/delete actions that circumvent the individual model classes.
     """
-    from django.core.cache import cache
-    from fluent_pages.extensions import page_type_pool
-    for model in page_type_pool.get_model_classes():
-        cache.delete('fluent_pages.instance_of.{0}'.format(model.__name__))
+    from fluent_pages.cache import expire_site_caches
+    expire_site_caches()
@@ -2,19 +2,32 @@
 The view to display CMS content.
 """
 import re
+from calendar import timegm
+from hashlib import md5
+from time import time
 
+import django
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import NoReverseMatch, Resolver404, get_script_prefix, resolve, reverse
-from django.http import Http404, HttpResponsePermanentRedirect, HttpResponseRedirect
+from django.http import Http404, HttpResponseNotModified, HttpResponsePermanentRedirect, HttpResponseRedirect
 from django.template.response import TemplateResponse
 from django.utils import translation
+from django.utils.cache import patch_cache_control
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.timezone import now
 from django.views.generic import RedirectView
 from django.views.generic.base import View
 from fluent_pages import appsettings
+from fluent_pages.cache import get_cache_version, get_content_version, get_site_modification_date
 from fluent_pages.models import UrlNode
-from fluent_pages.models.utils import prefill_parent_site
+from fluent_pages.models.utils import get_identity_map, prefill_parent_site
+from fluent_pages.routing import get_next_publication_change, get_path_candidates, get_path_routing_table, get_routing_table, not_found_cache, response_cache
 from future.builtins import str
+from future.utils import iteritems
+from parler.cache import is_missing
 
 
 # NOTE:
@@ -51,6 +64,10 @@ class CmsPageDispatcher(GetPathMixin, View):
     """
     model = UrlNode
     prefetch_translations = appsettings.FLUENT_PAGES_PREFETCH_TRANSLATIONS
+    use_routing_table = appsettings.FLUENT_PAGES_ROUTING_TABLE
+    use_single_query = appsettings.FLUENT_PAGES_SINGLE_QUERY_DISPATCH
+    not_found_cache = not_found_cache
+    response_cache = response_cache
 
     def get(self, request, **kwargs):
         """
@@ -58,9 +75,36 @@ class CmsPageDispatcher(GetPathMixin, View):
         """
         self.language_code = self.get_language()
         self.path = self.get_path()
+        self.response_cache_key = None
+        self._response_cache_miss_key = None
+
+        # Serve the rendered response of a previous request, without any queries.
+        if self._can_use_response_cache():
+            key = self.response_cache.get_key(settings.SITE_ID, self.language_code, self.path, self.request.META.get('QUERY_STRING', ''))
+            response = self.response_cache.get(self.request, key)
+            if response is not None:
+                return self._get_cached_response(response)
+
+            # Concurrent requests only wait for each other once the page is known to be cacheable.
+            self._response_cache_miss_key = key
+
+        try:
+            return self._get_response()
+        finally:
+            # Unless the response is stored, let the waiting requests render the page too.
+            if self.response_cache_key is not None:
+                self.response_cache.release(self.response_cache_key)
+
+    def _get_response(self):
+        # Avoid running all resolvers again for paths that are known to return a 404.
+        use_not_found_cache = self.not_found_cache is not None and not self.request.user.is_staff
+        if use_not_found_cache and self.not_found_cache.contains(*self._get_not_found_key()):
+            self._check_admin_not_found()
+            raise Http404(self._get_not_found_message())
 
         # See which view returns a valid response.
         for func in (
+            self._try_node_not_modified,
             self._try_node,
             self._try_node_redirect,
             self._try_appnode,
@@ -70,7 +114,43 @@ class CmsPageDispatcher(GetPathMixin, View):
             if response is not None:
                 return response
 
-        return self._page_not_found()
+        try:
+            return self._page_not_found()
+        except Http404:
+            if use_not_found_cache:
+                self.not_found_cache.add(*self._get_not_found_key())
+            raise
+
+    def _get_cached_response(self, response):
+        _update_max_age(response)
+        return _get_not_modified_response(self.request, etag=response.get('ETag')) or response
+
+    def _acquire_response_cache(self, plugin):
+        """
+        Claim the rendering of a cacheable page, or return the response that another request rendered in the meantime.
+        """
+        key = self._response_cache_miss_key
+        if key is None or not plugin.cache_timeout:
+            return None
+
+        if self.response_cache.acquire(key):
+            self.response_cache_key = key
+            return None
+
+        response = self.response_cache.get(self.request, key)
+        if response is not None:
+            return self._get_cached_response(response)
+        return None
+
+    def _can_use_response_cache(self):
+        if self.response_cache is None \
+                or self.request.method not in ('GET', 'HEAD') \
+                or _is_authenticated(self.request.user):
+            return False
+
+        # Avoid cache lookups when no page type uses it.
+        from fluent_pages.extensions import page_type_pool
+        return any(plugin.cache_timeout for plugin in page_type_pool.get_plugins())
 
     def post(self, request, **kwargs):
         """
@@ -79,6 +159,15 @@ class CmsPageDispatcher(GetPathMixin, View):
         return self.get(request, **kwargs)
 
     def _page_not_found(self):
+        self._check_admin_not_found()
+
+        if settings.DEBUG and self.model.objects.published().count() == 0 and self.path == '/':
+            # No pages in the database, present nice homepage.
+            return self._intro_page()
+        else:
+            raise Http404(self._get_not_found_message())
+
+    def _check_admin_not_found(self):
         # Since this view acts as a catch-all, give better error messages
         # when mistyping an admin URL. Don't mention anything about CMS pages in /admin.
         try:
@@ -89,21 +178,23 @@ class CmsPageDispatcher(GetPathMixin, View):
             # Admin might not be loaded.
             pass
 
-        if settings.DEBUG and self.model.objects.published().count() == 0 and self.path == '/':
-            # No pages in the database, present nice homepage.
-            return self._intro_page()
+    def _get_not_found_message(self):
+        fallback = _get_fallback_language(self.language_code)
+        if fallback:
+            languages = (self.language_code, fallback)
+            tried_msg = u" (language '{0}', fallback: '{1}')".format(*languages)
         else:
-            fallback = _get_fallback_language(self.language_code)
-            if fallback:
-                languages = (self.language_code, fallback)
-                tried_msg = u" (language '{0}', fallback: '{1}')".format(*languages)
-            else:
-                tried_msg = u", language '{0}'".format(self.language_code)
+            tried_msg = u", language '{0}'".format(self.language_code)
 
-            if self.path == '/':
-                raise Http404(u"No published '{0}' found for the path '{1}'{2}. Use the 'Override URL' field to make sure a page can be found at the root of the site.".format(self.model.__name__, self.path, tried_msg))
-            else:
-                raise Http404(u"No published '{0}' found for the path '{1}'{2}.".format(self.model.__name__, self.path, tried_msg))
+        if self.path == '/':
+            return u"No published '{0}' found for the path '{1}'{2}. " \
+                   u"Use the 'Override URL' field to make sure a page can be found at the root of the site.".format(self.model.__name__, self.path, tried_msg)
+        else:
+            return u"No published '{0}' found for the path '{1}'{2}.".format(self.model.__name__, self.path, tried_msg)
+
+    def _get_not_found_key(self):
+        # The APPEND_SLASH check also depends on the URLconf of the request.
+        return (settings.SITE_ID, self.language_code, self.path, getattr(self.request, 'urlconf', None))
 
     def _intro_page(self):
         return TemplateResponse(self.request, "fluent_pages/intro_page.html", {
@@ -117,20 +208,95 @@ class CmsPageDispatcher(GetPathMixin, View):
         """
         # This can be limited or expanded in the future
         qs = self.model.objects.published(for_user=self.request.user)
-        if self.prefetch_translations:
-            qs = qs.prefetch_related('translations')
-        return qs
+        return self._prefetch_translations(qs)
+
+    def get_node_queryset(self, model):
+        """
+        Return the QuerySet used to fetch the page type model of a page that was found.
+        This queries the concrete page type model directly, so no polymorphic queries are needed.
+        The query hints of the page type plugin are applied, see :func:`PageTypePlugin.apply_query_hints()
+        <fluent_pages.extensions.PageTypePlugin.apply_query_hints>`.
+        """
+        qs = self._prefetch_translations(model.objects.published(for_user=self.request.user))
+
+        from fluent_pages.extensions import PageTypeNotFound, page_type_pool
+        try:
+            plugin = page_type_pool.get_plugin_by_model(model)
+        except PageTypeNotFound:
+            return qs
+        return plugin.apply_query_hints(qs, language_codes=_get_language_codes(self.language_code))
+
+    def _prefetch_translations(self, qs):
+        if self.prefetch_translations == 'active':
+            return qs.prefetch_active_translations(self.language_code)
+        elif self.prefetch_translations:
+            return qs.prefetch_related('translations')
+        else:
+            return qs
 
     def get_object(self, path=None):
         """
         Return the UrlNode subclass object of the current page.
         """
         path = path or self.get_path()
-        qs = self.get_queryset()
+        routing_table = self.get_routing_table(path)
+        if routing_table is not None:
+            return _try_languages(self.language_code, UrlNode.DoesNotExist,
+                                  lambda lang: self._get_routed_object(routing_table.get(path, lang), path, lang)
+                                  )
 
-        return _try_languages(self.language_code, UrlNode.DoesNotExist,
-                              lambda lang: qs.get_for_path(path, language_code=lang)
-                              )
+        qs = _get_lookup_queryset(self.get_queryset())
+        return self._get_real_object(qs.get_for_path(path, language_code=_get_language_codes(self.language_code)))
+
+    def get_routing_table(self, path):
+        """
+        Return the :class:`~fluent_pages.routing.RoutingTable` that resolves the path,
+        or ``None`` to use the regular queries of :func:`get_queryset`.
+        """
+        if self.use_routing_table:
+            return get_routing_table()
+        elif self.use_single_query:
+            # All resolver functions share the same table,
+            # which contains the candidates for the path, the slash variant and all parent paths.
+            table = getattr(self, '_path_routing_table', None)
+            if table is None or not get_path_candidates(path).issubset(table.paths):
+                table = get_path_routing_table(path, self.language_code)
+                self._path_routing_table = table
+            return table
+        else:
+            return None
+
+    def _get_routed_object(self, entry, path, language_code):
+        """
+        Fetch the object of an entry in the in-memory routing table.
+        """
+        if entry is None or not entry.is_visible(for_user=self.request.user):
+            raise self.model.DoesNotExist(u"No published {0} found for the path '{1}'".format(self.model.__name__, path))
+
+        # The ContentType lookup is cached by Django, this doesn't cause a query.
+        model = ContentType.objects.get_for_id(entry.polymorphic_ctype_id).model_class()
+        if model is None:
+            raise self.model.DoesNotExist(u"The page type of node #{0} is no longer available.".format(entry.node_id))
+
+        obj = self.get_node_queryset(model).get(pk=entry.node_id)
+        obj.set_current_language(language_code)  # NOTE. Explicitly set language to the state the object was fetched in.
+        return obj
+
+    def _get_real_object(self, node):
+        """
+        Fetch the page type model of a node that was found by a non-polymorphic query.
+        This replaces the polymorphic query, so the query hints of the page type can be applied.
+        """
+        model = node.get_real_instance_class()
+        if model is None:
+            raise self.model.DoesNotExist(u"The page type of node #{0} is no longer available.".format(node.pk))
+
+        obj = self.get_node_queryset(model).get(pk=node.pk)
+        obj.set_current_language(node.get_current_language())  # NOTE. Explicitly set language to the state the object was fetched in.
+        _copy_missing_translations(node, obj)
+        obj._matched_language = node._matched_language
+        obj._has_first_language = node._has_first_language
+        return _mark_fallback(obj, self.language_code)
 
     def get_best_match_object(self, path=None):
         """
@@ -138,11 +304,15 @@ class CmsPageDispatcher(GetPathMixin, View):
         """
         # Only check for nodes with custom urlpatterns
         path = path or self.get_path()
-        qs = self.get_queryset().url_pattern_types()
+        routing_table = self.get_routing_table(path)
+        if routing_table is not None:
+            return _try_languages(self.language_code, UrlNode.DoesNotExist,
+                                  lambda lang: self._get_routed_object(
+                                      routing_table.best_match(path, lang, for_user=self.request.user), path, lang
+                                  ))
 
-        return _try_languages(self.language_code, UrlNode.DoesNotExist,
-                              lambda lang: qs.best_match_for_path(path, language_code=lang)
-                              )
+        qs = _get_lookup_queryset(self.get_queryset().url_pattern_types())
+        return self._get_real_object(qs.best_match_for_path(path, language_code=_get_language_codes(self.language_code)))
 
     def get_plugin(self):
         """
@@ -172,6 +342,56 @@ class CmsPageDispatcher(GetPathMixin, View):
 
         return self._call_node_view(plugin)
 
+    def _try_node_not_modified(self):
+        # When the routing table has the page, a conditional request can be answered before the page is fetched.
+        # This only works for the ETag, which is based on the version numbers of the site.
+        if self.request.method not in ('GET', 'HEAD') or not self.request.META.get('HTTP_IF_NONE_MATCH'):
+            return None
+
+        routing_table = self.get_routing_table(self.path)
+        entry = routing_table.get(self.path, self.language_code) if routing_table is not None else None
+        if entry is None or not entry.is_visible(for_user=self.request.user):
+            return None
+
+        from fluent_pages.extensions import PageTypeNotFound, page_type_pool
+        try:
+            plugin = page_type_pool._get_plugin_by_content_type(entry.polymorphic_ctype_id)
+        except PageTypeNotFound:
+            return None
+        if not plugin.conditional_requests or plugin.urls is not None:
+            # The root URL could be handled by a view of the plugin.
+            return None
+
+        etag = _get_etag(self.request, entry.node_id, self.language_code)
+        return _get_not_modified_response(self.request, etag=etag)
+
+    def _get_conditional_headers(self, plugin):
+        """
+        Return the ``ETag`` and ``Last-Modified`` value of the current page.
+        """
+        content_version = plugin.get_content_version(self.request, self.object)
+        last_modified = self.object.last_modified
+        etag = _get_etag(self.request, self.object.pk, self.object.get_current_language(), content_version)
+        if content_version is not None or _get_visitor_key(self.request):
+            # The modification date no longer tells whether the content changed.
+            return etag, None
+
+        # Other pages are also part of the output, e.g. in the menu.
+        site_modified = get_site_modification_date()
+        if last_modified is None or site_modified is None:
+            return etag, None
+        return etag, max(last_modified, site_modified)
+
+    def _get_publication_timeout(self, timeout):
+        """
+        Limit a cache timeout to the moment the page is hidden, or another page of the site is published or hidden.
+        """
+        current_time = now()
+        for moment in (self.object.publication_end_date, get_next_publication_change()):
+            if moment is not None and moment > current_time:
+                timeout = min(timeout, int((moment - current_time).total_seconds()))
+        return timeout
+
     def _call_node_view(self, plugin):
         """
         Call the regular view.
@@ -186,14 +406,45 @@ class CmsPageDispatcher(GetPathMixin, View):
         # and also avoids additional lookup in templatetags.
         # NOTE: django-fluent-blogs actually reads this variable too (should use CurrentPageMixin now)
         self.request._current_fluent_page = self.object
+        get_identity_map(self.request).add(self.object)
         prefill_parent_site(self.object)
 
+        # Avoid rendering the page when the browser has the same version.
+        is_conditional = plugin.conditional_requests and self.request.method in ('GET', 'HEAD')
+        if is_conditional:
+            etag, last_modified = self._get_conditional_headers(plugin)
+            response = _get_not_modified_response(self.request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+        response = self._acquire_response_cache(plugin)
+        if response is not None:
+            return response
+
         # Let page type plugin handle the request.
         response = plugin.get_response(self.request, self.object)
         if response is None:
             # Avoid automatic fallback to 404 page in this dispatcher.
             raise ValueError("The method '{0}.get_response()' didn't return an HttpResponse object.".format(plugin.__class__.__name__))
 
+        if is_conditional and response.status_code == 200:
+            if not response.has_header('ETag'):
+                response['ETag'] = etag
+            if last_modified is not None and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+
+        if self.request.method in ('GET', 'HEAD') and response.status_code == 200:
+            if plugin.cache_max_age is not None and not response.has_header('Cache-Control') \
+                    and not _is_authenticated(self.request.user):
+                _add_max_age(self.request, response, self._get_publication_timeout(plugin.cache_max_age))
+
+        if self.response_cache_key is not None and plugin.cache_timeout \
+                and plugin.can_cache_response(self.request, self.object, response):
+            # The key is released once the response is stored.
+            timeout = self._get_publication_timeout(plugin.cache_timeout)
+            self.response_cache.set(self.request, self.response_cache_key, response, timeout, plugin.cache_vary_headers)
+            self.response_cache_key = None
+
         return response
 
     def _try_node_redirect(self):
@@ -255,6 +506,7 @@ class CmsPageDispatcher(GetPathMixin, View):
 
         # Avoid additional lookup in templatetags
         self.request._current_fluent_page = self.object
+        get_identity_map(self.request).add(self.object)
         prefill_parent_site(self.object)
 
         # Get view response
@@ -306,8 +558,7 @@ class CmsPageAdminRedirect(GetPathMixin, RedirectView):
         qs = UrlNode.objects.non_polymorphic().published(for_user=self.request.user)
 
         try:
-            page = _try_languages(language_code, UrlNode.DoesNotExist,
-                                  lambda lang: qs.get_for_path(path, language_code=lang))
+            page = qs.get_for_path(path, language_code=_get_language_codes(language_code))
             url = get_page_admin_url(page)
         except UrlNode.DoesNotExist:
             # Back to page without @admin, display the error there.
@@ -340,13 +591,137 @@ def _try_languages(language_code, exception_class, func):
     return obj
 
 
+def _get_lookup_queryset(queryset):
+    # The lookup only needs to find the node, the prefetches and translations are applied by get_node_queryset().
+    queryset = queryset.non_polymorphic().prefetch_related(None)
+    queryset._prefetch_languages = None
+    return queryset
+
+
+def _copy_missing_translations(node, obj):
+    # Keep the missing translations the lookup found, without replacing the translations that obj already loaded.
+    for model, translations in iteritems(node._translations_cache):
+        local_cache = obj._translations_cache[model]
+        for language_code, value in iteritems(translations):
+            if is_missing(value):
+                local_cache.setdefault(language_code, value)
+
+
+def _mark_fallback(obj, requested_language):
+    """
+    Mark an object that was fetched with a language list, when it matched in the fallback language.
+    """
+    if obj.get_current_language() != requested_language:
+        obj._fetched_in_fallback_language = True
+    return obj
+
+
 def _is_accidental_fallback(obj, requested_language):
     # The object was resolved via the fallback language, but it has an official URL in the translated language.
     # Either _try_languages() can raise an exception, or we could perform a redirect on the users behalf.
+    matched_language = getattr(obj, '_matched_language', None)
+    if matched_language is not None:
+        # The lookup by _order_by_languages() already tells whether the requested translation exists.
+        return matched_language != requested_language and bool(obj._has_first_language)
+
     return getattr(obj, '_fetched_in_fallback_language', False) \
         and obj.has_translation(requested_language)
 
 
+_etag_re = re.compile(r'(?:W/)?("[^"]*")|(\*)')
+
+
+def _get_etag(request, node_id, language_code, content_version=None):
+    """
+    Return the quoted ``ETag`` value for a page.
+    This includes the cache and content version of the site, as the menu and breadcrumb display other pages too.
+    Each save of a page increments either version, hence the modification date is not needed.
+    """
+    value = u'{0}.{1}.{2}.{3}.{4}.{5}'.format(
+        node_id, language_code,
+        content_version if content_version is not None else '',
+        get_cache_version(),
+        get_content_version(),
+        _get_visitor_key(request),
+    )
+    return '"{0}"'.format(md5(force_bytes(value)).hexdigest())
+
+
+def _get_visitor_key(request):
+    """
+    Return the part of the validators that differs per visitor; the logged in user and the CSRF token.
+    """
+    user_id = request.user.pk if _is_authenticated(request.user) else ''
+    csrf_token = request.META.get('CSRF_COOKIE', '')
+    if not user_id and not csrf_token:
+        return ''
+    return u'{0}.{1}'.format(user_id, csrf_token)
+
+
+def _get_not_modified_response(request, etag=None, last_modified=None):
+    """
+    Return a ``304 Not Modified`` response when the request validates the given ETag or modification date.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_none_match:
+        # The If-None-Match header takes precedence.
+        tags = set(quoted or star for quoted, star in _etag_re.findall(if_none_match))
+        if not etag or ('*' not in tags and etag not in tags):
+            return None
+    elif if_modified_since and last_modified is not None:
+        since = parse_http_date_safe(if_modified_since)
+        if since is None or timegm(last_modified.utctimetuple()) > since:
+            return None
+    else:
+        return None
+
+    response = HttpResponseNotModified()
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+    return response
+
+
+def _add_max_age(request, response, max_age):
+    """
+    Add the ``Cache-Control: max-age`` header once the response is rendered.
+    Like the response cache, this skips responses that contain a CSRF token or set cookies for a single visitor.
+    """
+    def _patch(response):
+        if not response.has_header('Cache-Control') and not response.cookies and not request.META.get('CSRF_COOKIE_USED'):
+            patch_cache_control(response, max_age=max_age)
+            response._max_age_expires = time() + max_age  # for responses served by the response cache.
+
+    if callable(getattr(response, 'render', None)) and not response.is_rendered:
+        response.add_post_render_callback(_patch)
+    else:
+        _patch(response)
+
+
+def _update_max_age(response):
+    # A response from the cache should expire at the same moment as the original response.
+    expires = getattr(response, '_max_age_expires', None)
+    if expires is not None:
+        patch_cache_control(response, max_age=max(0, int(expires - time())))
+
+
+def _is_authenticated(user):
+    # Django 1.10 turned the method into a property.
+    if django.VERSION >= (1, 10):
+        return user.is_authenticated
+    return user.is_authenticated()
+
+
+def _get_language_codes(language_code):
+    """
+    Return the languages to try in a single query; the requested language and the fallback.
+    """
+    fallback = _get_fallback_language(language_code)
+    return [language_code, fallback] if fallback and fallback != language_code else [language_code]
+
+
 def _get_fallback_language(language_code):
     """
     Whether to try the default language.
@@ -41,7 +41,7 @@ setup(
     install_requires=[
         'django-fluent-utils>=1.2.3',      # DRY utility code
         'django-mptt>=0.7.0, != 0.8.5',    # Still allow 0.7 to have Django 1.7 support Workaround https://github.com/django-mptt/django-mptt/issues/494
-        'django-parler>=1.6.1',            # Needed for Django 1.9 compatibility
+        'django-parler>=1.8.1',            # Needed for parler.cache.is_missing()
         'django-polymorphic>=1.0.1',
         'django-polymorphic-tree>=1.4',
         'django-slug-preview>=1.0.2',